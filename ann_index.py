@@ -0,0 +1,139 @@
+import os
+import threading
+import numpy as np
+from matching import DEFAULT_BLOCK_SIZE, normalize_rows
+
+# Upper bound on rows used to fit the coarse quantizer
+MAX_TRAINING_SAMPLE = 25000
+
+class IVFIndex:
+    """Inverted-file approximate nearest-neighbour index over one gallery
+
+    A spherical k-means coarse quantizer splits the normalized encodings into
+    nlist cells; each cell keeps a posting list of record ids. A query only
+    scores the records in the nprobe cells whose centroids are closest, so
+    nprobe trades recall for latency (nprobe == nlist is exact search).
+    Vectors themselves stay in the gallery cache; the index holds only ids.
+    space identifies the embedding the centroids live in (the projection
+    version), so an index trained before a re-projection is never reused.
+    """
+
+    def __init__(self, centroids, lists, space=0):
+        self.centroids = centroids
+        self.lists = lists
+        self.space = space
+        self.max_id = max((int(ids.max()) for ids in lists if ids.size), default=0)
+        self.pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def dim(self):
+        return self.centroids.shape[1]
+
+    @property
+    def nlist(self):
+        return self.centroids.shape[0]
+
+    def __len__(self):
+        return sum(ids.size for ids in self.lists)
+
+    @classmethod
+    def train(cls, matrix, ids, nlist=None, iterations=10, sample_size=None, seed=0, space=0):
+        """Cluster a normalized (n, dim) matrix and index every row by id"""
+        n = matrix.shape[0]
+        if nlist is None:
+            nlist = int(np.clip(4 * np.sqrt(n), 1, 4096))
+        nlist = min(nlist, n)
+
+        rng = np.random.default_rng(seed)
+        sample_size = min(n, sample_size or min(max(40 * nlist, 10000), MAX_TRAINING_SAMPLE))
+        # Quantized galleries are widened to float32 for the sample only
+        sample = np.asarray(matrix[np.sort(rng.choice(n, sample_size, replace=False))],
+                            dtype=np.float32)
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+        for _ in range(iterations):
+            assignment = _assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            counts = np.bincount(assignment, minlength=nlist)
+
+            # Re-seed empty cells from random sample points
+            empty = counts == 0
+            if empty.any():
+                sums[empty] = sample[rng.choice(sample_size, int(empty.sum()), replace=False)]
+            centroids = normalize_rows(sums)
+
+        assignment = _assign(matrix, centroids)
+        ids = np.asarray(ids, dtype=np.int64)
+        lists = [ids[assignment == cell] for cell in range(nlist)]
+        return cls(centroids, lists, space=space)
+
+    def add(self, record_ids, matrix):
+        """Add normalized encodings to the cells of their nearest centroids"""
+        record_ids = np.asarray(record_ids, dtype=np.int64)
+        if record_ids.size == 0:
+            return
+        with self._lock:
+            self._add(record_ids, matrix)
+
+    def sync(self, gallery):
+        """Add any gallery records inserted after this index last saw one
+
+        Record ids are autoincrement, so new records are exactly those with an
+        id above max_id. Removed records are simply skipped at search time.
+        """
+        # Take the matrix first: ids and records are never shorter than it
+        matrix = gallery.matrix
+        ids = gallery.ids[:matrix.shape[0]]
+        # Pick the new rows under the lock, or concurrent searches syncing
+        # the same index would each add them
+        with self._lock:
+            new_rows = np.flatnonzero(ids > self.max_id)
+            if new_rows.size:
+                self._add(ids[new_rows], matrix[new_rows])
+
+    def _add(self, record_ids, matrix):
+        # Caller holds self._lock
+        assignment = _assign(matrix, self.centroids)
+        for cell in np.unique(assignment):
+            self.lists[cell] = np.append(self.lists[cell], record_ids[assignment == cell])
+        self.max_id = max(self.max_id, int(record_ids.max()))
+        self.pending += record_ids.size
+
+    def candidate_ids(self, query, nprobe):
+        """Ids in the nprobe cells closest to a normalized query"""
+        nprobe = min(nprobe, self.nlist)
+        cells = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        return np.concatenate([self.lists[cell] for cell in cells])
+
+    def save(self, path):
+        with self._lock:
+            sizes = np.array([ids.size for ids in self.lists], dtype=np.int64)
+            ids = np.concatenate(self.lists) if self.lists else np.zeros(0, dtype=np.int64)
+            tmp_path = path + '.tmp.npz'
+            np.savez(tmp_path, centroids=self.centroids, list_sizes=sizes, list_ids=ids,
+                     space=np.array(self.space))
+            os.replace(tmp_path, path)
+            self.pending = 0
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            centroids = data['centroids']
+            offsets = np.cumsum(data['list_sizes'])[:-1]
+            lists = np.split(data['list_ids'], offsets)
+            space = int(data['space']) if 'space' in data else 0
+        return cls(centroids, lists, space=space)
+
+def _assign(matrix, centroids, block_size=DEFAULT_BLOCK_SIZE):
+    """Index of the most similar centroid for each row, computed in blocks"""
+    assignment = np.empty(matrix.shape[0], dtype=np.intp)
+    for start in range(0, matrix.shape[0], block_size):
+        block = matrix[start:start + block_size]
+        assignment[start:start + block_size] = np.argmax(block @ centroids.T, axis=1)
+    return assignment
+
+def index_path(db_path, table):
+    """Where the index for one table of db_path is persisted"""
+    return f"{os.path.splitext(db_path)[0]}.{table}.ivf.npz"
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Compare face-detection latency and results across detection settings
+
+Every image is decoded once up front, then each setting (max detection side,
+scaleFactor, minNeighbors) is timed on the decoded images. Detections are
+compared with the first (full-resolution) setting: a face counts as found
+again when a box overlaps a baseline box with IoU >= 0.5.
+"""
+
+import argparse
+import itertools
+import os
+import time
+import cv2
+import numpy as np
+from bulk_ingest import IMAGE_EXTENSIONS
+from face_recognition_system import DEFAULT_MIN_NEIGHBORS, DEFAULT_SCALE_FACTOR, FaceRecognitionSystem
+
+def load_images(paths, upscale=1.0):
+    """Decode image files (folders are expanded); optionally enlarge them to mimic big uploads"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                         if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS)
+        else:
+            files.append(path)
+
+    images = []
+    for file_path in files:
+        image = cv2.imread(file_path)
+        if image is None:
+            print(f"Skipping unreadable image {file_path}")
+            continue
+        if upscale != 1.0:
+            image = cv2.resize(image, None, fx=upscale, fy=upscale, interpolation=cv2.INTER_CUBIC)
+        images.append(image)
+    return images
+
+def _iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    overlap_w = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    overlap_h = max(0, min(ay + ah, by + bh) - max(ay, by))
+    overlap = overlap_w * overlap_h
+    return overlap / float(aw * ah + bw * bh - overlap)
+
+def _recovered(baseline_boxes, boxes):
+    return sum(any(_iou(a, b) >= 0.5 for b in boxes) for a in baseline_boxes)
+
+def benchmark(images, max_sides=(None, 1280, 960, 640), scale_factors=(DEFAULT_SCALE_FACTOR,),
+              min_neighbors=(DEFAULT_MIN_NEIGHBORS,), repeat=1):
+    """Return one result dict per setting; the first setting is the baseline"""
+    face_system = FaceRecognitionSystem(db_path=None)
+    results = []
+    baseline = None
+
+    for max_side, scale_factor, neighbors in itertools.product(max_sides, scale_factors, min_neighbors):
+        face_system.detection_max_side = max_side
+        face_system.scale_factor = scale_factor
+        face_system.min_neighbors = neighbors
+
+        latencies = []
+        detections = []
+        for image in images:
+            for _ in range(repeat):
+                start_time = time.perf_counter()
+                _, boxes = face_system.detect_faces_in_image(image)
+                latencies.append(time.perf_counter() - start_time)
+            detections.append([tuple(int(v) for v in box) for box in boxes])
+
+        if baseline is None:
+            baseline = detections
+        baseline_faces = sum(len(boxes) for boxes in baseline)
+        recovered = sum(_recovered(a, b) for a, b in zip(baseline, detections))
+
+        latencies = np.array(latencies) * 1000
+        results.append({
+            'max_side': max_side,
+            'scale_factor': scale_factor,
+            'min_neighbors': neighbors,
+            'mean_ms': float(latencies.mean()),
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p95_ms': float(np.percentile(latencies, 95)),
+            'faces': sum(len(boxes) for boxes in detections),
+            'baseline_recall': recovered / baseline_faces if baseline_faces else 1.0
+        })
+
+    return results
+
+def _parse_list(value, cast):
+    return tuple(None if item in ('0', 'none', 'full') else cast(item) for item in value.split(','))
+
+if __name__ == "__main__":
+    print("Police Facial Recognition System - Detection Benchmark")
+    print("=" * 60)
+
+    parser = argparse.ArgumentParser(description="Face-detection latency per setting")
+    parser.add_argument('images', nargs='+', help='image files or folders')
+    parser.add_argument('--max-sides', default='full,1280,960,640',
+                        help="comma-separated detection max sides ('full' = no downscaling)")
+    parser.add_argument('--scale-factors', default=str(DEFAULT_SCALE_FACTOR), help='comma-separated scaleFactor values')
+    parser.add_argument('--min-neighbors', default=str(DEFAULT_MIN_NEIGHBORS), help='comma-separated minNeighbors values')
+    parser.add_argument('--upscale', type=float, default=1.0, help='enlarge inputs, e.g. 4 to mimic 12 MP photos')
+    parser.add_argument('--repeat', type=int, default=1, help='timed runs per image')
+    args = parser.parse_args()
+
+    images = load_images(args.images, args.upscale)
+    if not images:
+        raise SystemExit("No readable images")
+    print(f"{len(images)} images, median size {int(np.median([max(i.shape[:2]) for i in images]))} px (longer side)\n")
+
+    results = benchmark(images, _parse_list(args.max_sides, int), _parse_list(args.scale_factors, float),
+                        _parse_list(args.min_neighbors, int), args.repeat)
+    for result in results:
+        print(f"max_side {str(result['max_side'] or 'full'):>5}  scaleFactor {result['scale_factor']:<4}  "
+              f"minNeighbors {result['min_neighbors']:<2}  mean {result['mean_ms']:8.1f} ms  "
+              f"p50 {result['p50_ms']:8.1f} ms  p95 {result['p95_ms']:8.1f} ms  "
+              f"faces {result['faces']:>4}  baseline recall {result['baseline_recall']:.0%}")
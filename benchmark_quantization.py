@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Measure what quantized gallery storage saves and costs on the current database
+
+For every gallery and precision this reports the memory held by the
+encodings and the top-k recall against exact float32 search, using a sample
+of gallery records as queries (each query's own record is ignored).
+"""
+
+import argparse
+import time
+import numpy as np
+from database import PoliceDatabase
+from gallery_cache import get_gallery_cache
+from matching import top_k
+from quantization import QUANTIZATION_MODES, quantize_rows
+
+def benchmark(db_path="police_records.db", k=10, n_queries=200, seed=0):
+    """Return one result dict per (table, precision)"""
+    cache = get_gallery_cache(PoliceDatabase(db_path))
+    rng = np.random.default_rng(seed)
+    results = []
+
+    for table in ('missing_persons', 'unidentified_bodies'):
+        reference = cache.gallery(table).matrix
+        if reference.shape[0] < 2:
+            continue
+
+        query_rows = rng.choice(reference.shape[0], min(n_queries, reference.shape[0]), replace=False)
+        queries = reference[query_rows]
+        exact = [_top_k_excluding(reference @ query, row, k) for row, query in zip(query_rows, queries)]
+
+        for mode in QUANTIZATION_MODES:
+            matrix = quantize_rows(reference, mode)
+
+            start_time = time.perf_counter()
+            found = [_top_k_excluding(matrix @ query, row, k) for row, query in zip(query_rows, queries)]
+            elapsed = time.perf_counter() - start_time
+
+            recall = np.mean([np.intersect1d(a, b).size / max(a.size, 1) for a, b in zip(exact, found)])
+            results.append({
+                'table': table,
+                'quantization': mode,
+                'records': reference.shape[0],
+                'bytes': matrix.nbytes,
+                'memory_saved': 1 - matrix.nbytes / reference.nbytes,
+                f'recall@{k}': float(recall),
+                'ms_per_query': 1000 * elapsed / len(queries)
+            })
+
+    return results
+
+def _top_k_excluding(scores, row, k):
+    scores[row] = -np.inf
+    return top_k(scores, k)
+
+if __name__ == "__main__":
+    print("Police Facial Recognition System - Quantization Benchmark")
+    print("=" * 60)
+
+    parser = argparse.ArgumentParser(description="Memory and recall of quantized galleries")
+    parser.add_argument('--db', default='police_records.db', help='database path')
+    parser.add_argument('--k', type=int, default=10, help='results per query')
+    parser.add_argument('--queries', type=int, default=200, help='sampled query records per gallery')
+    args = parser.parse_args()
+
+    results = benchmark(args.db, args.k, args.queries)
+    if not results:
+        print("No gallery has enough encodings to benchmark")
+
+    for result in results:
+        print(f"{result['table']:<20} {result['quantization']:<8} "
+              f"{result['records']:>8} records  {result['bytes'] / 2**20:>9.2f} MiB  "
+              f"saved {result['memory_saved']:>4.0%}  recall@{args.k} {result[f'recall@{args.k}']:.4f}  "
+              f"{result['ms_per_query']:.2f} ms/query")
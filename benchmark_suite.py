@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+End-to-end performance benchmark on a synthetic gallery
+
+Generates missing persons and unidentified bodies with random encodings,
+planting a known set of true matches (a body whose encoding is a noisy copy
+of a missing person's), then times:
+
+  ingest       batched inserts into a fresh database
+  full_match   find_matches over the whole gallery
+  incremental  find_matches(incremental=True) after a further insert batch
+  search       top-k search_by_encoding for planted missing persons
+
+Each stage reports throughput, latency percentiles where applicable, peak
+RSS and recall of the planted matches. Results are printed (or written) as
+JSON so runs can be compared over time.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import numpy as np
+from candidate_filter import CandidateFilter
+from face_recognition_system import ANN_MIN_GALLERY_SIZE, FaceRecognitionSystem
+from parallel_matching import DEFAULT_SHARD_SIZE
+from quantization import QUANTIZATION_MODES
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MiB (None if unknown)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    return peak / (2**20 if sys.platform == 'darwin' else 2**10)
+
+class SyntheticGallery:
+    """Random unit encodings with planted (missing person, body) true matches
+
+    Unrelated random vectors in a few hundred dimensions have cosine
+    similarity near 0, so at any useful threshold the planted pairs are the
+    only true matches; noise sets how similar each planted pair is.
+    """
+
+    def __init__(self, dim=256, noise=0.3, seed=0):
+        self.dim = dim
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+        self.person_count = 0
+        self.body_count = 0
+
+    def _encodings(self, n):
+        return self.rng.standard_normal((n, self.dim)).astype(np.float32) / np.sqrt(self.dim)
+
+    def missing_persons(self, n):
+        """n missing-person records (dicts of add_missing_person's arguments)"""
+        records = []
+        for encoding in self._encodings(n):
+            self.person_count += 1
+            records.append({
+                'name': f"Synthetic Person {self.person_count}",
+                'age': int(self.rng.integers(1, 90)),
+                'gender': 'Male' if self.rng.random() < 0.5 else 'Female',
+                'last_seen_date': '2024-01-01',
+                'last_seen_location': 'Synthetic City',
+                'description': '',
+                'case_number': f"SMP-{self.person_count:07d}",
+                'face_encoding': encoding,
+                'photo_path': ''
+            })
+        return records
+
+    def unidentified_bodies(self, n, planted_from=()):
+        """n body records; the first len(planted_from) copy those persons' faces"""
+        encodings = self._encodings(n)
+        for row, person in enumerate(planted_from):
+            encodings[row] = person['face_encoding'] + self.noise * encodings[row]
+
+        records = []
+        for encoding in encodings:
+            self.body_count += 1
+            records.append({
+                'case_number': f"SUB-{self.body_count:07d}",
+                'found_date': '2024-02-01',
+                'found_location': 'Synthetic City',
+                'estimated_age': int(self.rng.integers(1, 90)),
+                'gender': 'Male' if self.rng.random() < 0.5 else 'Female',
+                'description': '',
+                'face_encoding': encoding,
+                'photo_path': ''
+            })
+        # Planted bodies are the same people, so their metadata agrees too
+        for record, person in zip(records, planted_from):
+            record['gender'] = person['gender']
+            record['estimated_age'] = min(89, max(1, person['age'] + int(self.rng.integers(-5, 6))))
+        return records
+
+def _insert(db, persons, bodies, batch_size):
+    for start in range(0, len(persons), batch_size):
+        db.add_missing_persons(persons[start:start + batch_size])
+    for start in range(0, len(bodies), batch_size):
+        db.add_unidentified_bodies(bodies[start:start + batch_size])
+
+def _recall(matches, planted):
+    found = {(match['missing_case'], match['body_case']) for match in matches}
+    return len(found & planted) / len(planted) if planted else 1.0
+
+def _planted_pairs(persons, bodies):
+    return {(person['case_number'], body['case_number']) for person, body in zip(persons, bodies)}
+
+def run(db_path, persons=10000, bodies=10000, planted=500, dim=256, noise=0.3, threshold=0.7,
+        incremental_fraction=0.01, queries=200, k=10, batch_size=1000, seed=0,
+        candidate_filter=None, **system_options):
+    """Run every stage against db_path (which should not exist yet); returns the report dict"""
+    planted = min(planted, persons, bodies)
+    generator = SyntheticGallery(dim=dim, noise=noise, seed=seed)
+    face_system = FaceRecognitionSystem(db_path=db_path, match_threshold=None,
+                                        candidate_filter=candidate_filter, **system_options)
+    stages = {}
+
+    person_records = generator.missing_persons(persons)
+    body_records = generator.unidentified_bodies(bodies, planted_from=person_records[:planted])
+    planted_pairs = _planted_pairs(person_records[:planted], body_records[:planted])
+
+    start_time = time.perf_counter()
+    _insert(face_system.db, person_records, body_records, batch_size)
+    elapsed = time.perf_counter() - start_time
+    stages['ingest'] = {'records': persons + bodies, 'seconds': elapsed,
+                        'records_per_second': (persons + bodies) / elapsed, 'peak_rss_mb': peak_rss_mb()}
+
+    start_time = time.perf_counter()
+    matches = face_system.find_matches(threshold)
+    elapsed = time.perf_counter() - start_time
+    stages['full_match'] = {'pairs_scored': persons * bodies, 'matches': len(matches), 'seconds': elapsed,
+                            'pairs_per_second': persons * bodies / elapsed,
+                            'recall': _recall(matches, planted_pairs), 'peak_rss_mb': peak_rss_mb()}
+
+    # A further batch on both sides; some new bodies are planted from new persons
+    new_persons = generator.missing_persons(max(1, int(persons * incremental_fraction)))
+    new_bodies = generator.unidentified_bodies(max(1, int(bodies * incremental_fraction)),
+                                               planted_from=new_persons[:max(1, planted // 10)])
+    new_planted = _planted_pairs(new_persons, new_bodies[:max(1, planted // 10)])
+    _insert(face_system.db, new_persons, new_bodies, batch_size)
+
+    start_time = time.perf_counter()
+    matches = face_system.find_matches(threshold, incremental=True)
+    elapsed = time.perf_counter() - start_time
+    stages['incremental'] = {'new_records': len(new_persons) + len(new_bodies), 'matches': len(matches),
+                             'seconds': elapsed, 'recall': _recall(matches, new_planted),
+                             'peak_rss_mb': peak_rss_mb()}
+
+    # Search with planted missing persons; their body should come back in the top k
+    query_rows = np.random.default_rng(seed).choice(planted, min(queries, planted), replace=False)
+    face_system.search_by_encoding(person_records[0]['face_encoding'], 0.0, k)  # load caches/indexes
+    latencies = []
+    hits = 0
+    for row in query_rows:
+        start_time = time.perf_counter()
+        results = face_system.search_by_encoding(person_records[row]['face_encoding'], 0.0, k)
+        latencies.append(time.perf_counter() - start_time)
+        hits += any(result['case_number'] == body_records[row]['case_number'] for result in results)
+
+    latencies = np.array(latencies) * 1000
+    stages['search'] = {'queries': len(query_rows), 'k': k,
+                        'queries_per_second': len(query_rows) / (latencies.sum() / 1000),
+                        'p50_ms': float(np.percentile(latencies, 50)),
+                        'p99_ms': float(np.percentile(latencies, 99)),
+                        f'recall@{k}': hits / len(query_rows), 'peak_rss_mb': peak_rss_mb()}
+
+    return {
+        'config': {'persons': persons, 'bodies': bodies, 'planted': planted, 'dim': dim,
+                   'noise': noise, 'threshold': threshold, 'batch_size': batch_size,
+                   'seed': seed, 'candidate_filter': candidate_filter is not None, **system_options},
+        'environment': {'python': platform.python_version(), 'numpy': np.__version__,
+                        'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'stages': stages
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ingest, matching and search on a synthetic gallery")
+    parser.add_argument('--size', type=int, default=None, help='records per gallery (sets --persons and --bodies)')
+    parser.add_argument('--persons', type=int, default=10000, help='missing persons to generate')
+    parser.add_argument('--bodies', type=int, default=10000, help='unidentified bodies to generate')
+    parser.add_argument('--planted', type=int, default=500, help='planted true matches')
+    parser.add_argument('--dim', type=int, default=256, help='encoding dimensions')
+    parser.add_argument('--noise', type=float, default=0.3, help='noise added to planted matches')
+    parser.add_argument('--threshold', type=float, default=0.7, help='match threshold')
+    parser.add_argument('--queries', type=int, default=200, help='search queries to time')
+    parser.add_argument('--k', type=int, default=10, help='search results per query')
+    parser.add_argument('--batch-size', type=int, default=1000, help='records per insert transaction')
+    parser.add_argument('--quantization', choices=QUANTIZATION_MODES, default='float32')
+    parser.add_argument('--ann-min-size', type=int, default=ANN_MIN_GALLERY_SIZE,
+                        help='gallery size from which search uses the IVF index')
+    parser.add_argument('--candidate-filter', action='store_true',
+                        help='skip pairs ruled out by gender, age and dates before scoring')
+    parser.add_argument('--match-workers', type=int, default=1,
+                        help='processes for full matching (0: one per CPU)')
+    parser.add_argument('--match-shard-size', type=int, default=DEFAULT_SHARD_SIZE,
+                        help='bodies scored per parallel matching task')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    if args.size is not None:
+        args.persons = args.bodies = args.size
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        report = run(os.path.join(tmp_dir, 'benchmark.db'), persons=args.persons, bodies=args.bodies,
+                     planted=args.planted, dim=args.dim, noise=args.noise, threshold=args.threshold,
+                     queries=args.queries, k=args.k, batch_size=args.batch_size, seed=args.seed,
+                     quantization=args.quantization, ann_min_size=args.ann_min_size,
+                     candidate_filter=CandidateFilter() if args.candidate_filter else None,
+                     match_workers=args.match_workers or None, match_shard_size=args.match_shard_size)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
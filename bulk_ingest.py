@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Bulk ingest archived case photos into the Police Facial Recognition System
+
+Photos come from a folder (case number taken from each file name) or a CSV
+manifest with one row per record and a photo_path column. Face detection and
+feature extraction run across a process pool; records are written in batched
+transactions. Re-running after a crash skips case numbers already stored.
+"""
+
+import argparse
+import csv
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from face_recognition_system import FaceRecognitionSystem
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.bmp'}
+
+MISSING_PERSON_FIELDS = ('name', 'age', 'gender', 'last_seen_date',
+                         'last_seen_location', 'description', 'case_number')
+UNIDENTIFIED_BODY_FIELDS = ('case_number', 'found_date', 'found_location',
+                            'estimated_age', 'gender', 'description')
+
+_worker_system = None
+
+def _init_worker(detection_max_side=None):
+    global _worker_system
+    _worker_system = FaceRecognitionSystem(db_path=None, detection_max_side=detection_max_side)
+
+def _encode_photo(photo_path):
+    """Worker: return (encoding, error) for the largest face in a photo"""
+    try:
+        faces, face_coords = _worker_system.detect_faces(photo_path)
+        if not faces:
+            return None, 'no face detected'
+
+        largest_face = max(faces, key=lambda x: x.shape[0] * x.shape[1])
+        face_encoding = _worker_system.extract_face_features(largest_face)
+        if face_encoding is None:
+            return None, 'feature extraction failed'
+        return face_encoding, None
+    except Exception as e:
+        return None, str(e)
+
+def load_folder(folder, record_type):
+    """One record per image file, using the file name as case number"""
+    records = []
+    for filename in sorted(os.listdir(folder)):
+        stem, extension = os.path.splitext(filename)
+        if extension.lower() not in IMAGE_EXTENSIONS:
+            continue
+
+        record = {'case_number': stem, 'photo_path': os.path.join(folder, filename)}
+        if record_type == 'missing':
+            record['name'] = stem
+        records.append(record)
+    return records
+
+def load_manifest(manifest_path):
+    """Read CSV rows; relative photo paths are resolved against the manifest"""
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    records = []
+    with open(manifest_path, newline='') as f:
+        for row in csv.DictReader(f):
+            photo_path = row.get('photo_path', '')
+            if photo_path and not os.path.isabs(photo_path):
+                row['photo_path'] = os.path.join(base_dir, photo_path)
+            records.append(row)
+    return records
+
+def _to_int(value):
+    return int(value) if value not in (None, '') else None
+
+def _build_record(record, record_type, encodings):
+    if record_type == 'missing':
+        data = {field: record.get(field) or None for field in MISSING_PERSON_FIELDS}
+        data['age'] = _to_int(data['age'])
+    else:
+        data = {field: record.get(field) or None for field in UNIDENTIFIED_BODY_FIELDS}
+        data['estimated_age'] = _to_int(data['estimated_age'])
+    data['photo_path'] = record['photo_path']
+    data.update(encodings)
+    return data
+
+def ingest(source, record_type, db_path="police_records.db", workers=None,
+           batch_size=200, error_report="ingest_errors.csv", match=False, detection_max_side=None):
+    """Ingest every record from a folder or CSV manifest; returns a summary dict"""
+    face_system = FaceRecognitionSystem(db_path=db_path)
+    db = face_system.db
+    table = 'missing_persons' if record_type == 'missing' else 'unidentified_bodies'
+    insert_batch = db.add_missing_persons if record_type == 'missing' else db.add_unidentified_bodies
+
+    if os.path.isdir(source):
+        records = load_folder(source, record_type)
+    else:
+        records = load_manifest(source)
+
+    # Resume: anything already stored was committed by an earlier run
+    existing = db.get_case_numbers(table)
+    pending = [record for record in records if record.get('case_number') not in existing]
+    skipped = len(records) - len(pending)
+
+    print(f"{len(records)} records found, {skipped} already ingested, {len(pending)} to process")
+
+    errors = []
+    ingested = 0
+    batch = []
+    start_time = time.time()
+
+    def flush():
+        nonlocal ingested
+        if not batch:
+            return
+        try:
+            insert_batch([data for _, data in batch])
+            ingested += len(batch)
+        except Exception:
+            # Isolate the bad rows so one duplicate doesn't sink the batch
+            for record, data in batch:
+                try:
+                    insert_batch([data])
+                    ingested += 1
+                except Exception as e:
+                    errors.append((record['photo_path'], record.get('case_number'), str(e)))
+        batch.clear()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(detection_max_side,)) as executor:
+        photo_paths = [record['photo_path'] for record in pending]
+        results = executor.map(_encode_photo, photo_paths, chunksize=8)
+
+        for processed, (record, (face_encoding, error)) in enumerate(zip(pending, results), 1):
+            if error:
+                errors.append((record['photo_path'], record.get('case_number'), error))
+            else:
+                encodings = face_system.storage_encodings(face_encoding)
+                batch.append((record, _build_record(record, record_type, encodings)))
+
+            if len(batch) >= batch_size:
+                flush()
+
+            if processed % batch_size == 0 or processed == len(pending):
+                flush()
+                elapsed = time.time() - start_time
+                print(f"[{processed}/{len(pending)}] ingested {ingested}, errors {len(errors)}, "
+                      f"{processed / elapsed:.1f} photos/s")
+
+    if errors:
+        with open(error_report, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['photo_path', 'case_number', 'error'])
+            writer.writerows(errors)
+        print(f"Wrote {len(errors)} errors to {error_report}")
+
+    matches = face_system.find_matches(incremental=True) if match else []
+    if match:
+        print(f"Found {len(matches)} potential matches for new records")
+
+    return {'found': len(records), 'skipped': skipped, 'ingested': ingested,
+            'errors': len(errors), 'matches': len(matches)}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('source', help='folder of photos or CSV manifest')
+    parser.add_argument('--type', choices=('missing', 'body'), required=True,
+                        help='ingest missing persons or unidentified bodies')
+    parser.add_argument('--db', default='police_records.db', help='database path')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--batch-size', type=int, default=200, help='records per transaction')
+    parser.add_argument('--errors', default='ingest_errors.csv', help='per-file error report')
+    parser.add_argument('--match', action='store_true', help='run incremental matching afterwards')
+    parser.add_argument('--detection-max-side', type=int, default=None,
+                        help='detect faces on photos downscaled to this longer side (fast mode)')
+    args = parser.parse_args(argv)
+
+    summary = ingest(args.source, args.type, db_path=args.db, workers=args.workers,
+                     batch_size=args.batch_size, error_report=args.errors, match=args.match,
+                     detection_max_side=args.detection_max_side)
+    print(f"\nIngest complete: {summary}")
+
+if __name__ == "__main__":
+    print("Police Facial Recognition System - Bulk Ingest")
+    print("=" * 60)
+    main(sys.argv[1:])
@@ -0,0 +1,178 @@
+"""
+Metadata pre-filtering of match candidates
+
+A body found before a person was last seen, of the other sex, or with an
+estimated age far from theirs cannot be that person, so there is no point
+scoring their faces. CandidateFilter turns those rules into boolean masks
+over the in-memory galleries and hands the matcher only the tiles of
+compatible pairs, so a full match run does a fraction of the vector work.
+
+Missing or unparseable metadata never excludes a pair: an unknown gender,
+age, date or region is compatible with everything.
+"""
+
+from collections import namedtuple
+import numpy as np
+
+# Years an estimated age may differ from the age a person was reported at.
+# Body age estimates are rough and people age while missing, so keep it wide.
+DEFAULT_AGE_TOLERANCE = 15
+
+UNKNOWN = -1
+GENDER_CODES = {'male': 0, 'm': 0, 'female': 1, 'f': 1}
+
+# Per-row metadata of one gallery as arrays: int8 gender and int32 region
+# codes (UNKNOWN when missing), float32 age (nan) and datetime64[D] date (NaT)
+Attributes = namedtuple('Attributes', ('gender', 'age', 'date', 'region'))
+
+def location_region(location):
+    """Default region key: the last comma-separated part of a location
+
+    "12 Main St, Springfield, IL" -> "il"; None when there is no location.
+    """
+    if not location:
+        return None
+    return location.rsplit(',', 1)[-1].strip().lower() or None
+
+def gender_codes(values):
+    return np.fromiter((GENDER_CODES.get(str(value).strip().lower(), UNKNOWN) if value else UNKNOWN
+                        for value in values), dtype=np.int8, count=len(values))
+
+def age_values(values):
+    ages = np.full(len(values), np.nan, dtype=np.float32)
+    for row, value in enumerate(values):
+        try:
+            ages[row] = float(value)
+        except (TypeError, ValueError):
+            pass
+    return ages
+
+def date_values(values):
+    dates = np.full(len(values), np.datetime64('NaT'), dtype='datetime64[D]')
+    for row, value in enumerate(values):
+        try:
+            dates[row] = np.datetime64(str(value)[:10], 'D')
+        except ValueError:
+            pass
+    return dates
+
+def _take(attributes, rows):
+    return Attributes(*(values[rows] for values in attributes))
+
+def _compatible_codes(codes, allowed):
+    """Mask of codes compatible with any of allowed (UNKNOWN matches everything)"""
+    if (allowed == UNKNOWN).any():
+        return np.ones(codes.shape, dtype=bool)
+    return np.isin(codes, allowed) | (codes == UNKNOWN)
+
+def _same_code(person_codes, body_codes):
+    return (person_codes == body_codes) | (person_codes == UNKNOWN) | (body_codes == UNKNOWN)
+
+class CandidateFilter:
+    """Rules deciding which (missing person, body) pairs are worth scoring
+
+    gender        skip pairs whose recorded genders differ
+    age_tolerance skip pairs whose ages differ by more than this many years
+                  (None disables the rule)
+    date_order    skip bodies found before the person was last seen
+    region        None, or a function mapping a location to a region key;
+                  pairs in different regions are skipped. True uses
+                  location_region.
+    """
+
+    def __init__(self, gender=True, age_tolerance=DEFAULT_AGE_TOLERANCE, date_order=True, region=None):
+        self.gender = gender
+        self.age_tolerance = age_tolerance
+        self.date_order = date_order
+        self.region = location_region if region is True else region
+        self._region_codes = {}
+
+    def _region_code(self, location):
+        region = self.region(location)
+        if region is None:
+            return UNKNOWN
+        return self._region_codes.setdefault(region, len(self._region_codes))
+
+    def _attributes(self, gallery, age_column, date_column, location_column):
+        def compute(gallery):
+            records = gallery.records
+            column = lambda name: [record[name] for record in records]
+            if self.region is None:
+                regions = np.full(len(records), UNKNOWN, dtype=np.int32)
+            else:
+                regions = np.fromiter((self._region_code(location) for location in column(location_column)),
+                                      dtype=np.int32, count=len(records))
+            return Attributes(gender_codes(column('gender')), age_values(column(age_column)),
+                              date_values(column(date_column)), regions)
+        return gallery.derived(('candidate_filter', id(self)), compute)
+
+    def person_attributes(self, gallery):
+        return self._attributes(gallery, 'age', 'last_seen_date', 'last_seen_location')
+
+    def body_attributes(self, gallery):
+        return self._attributes(gallery, 'estimated_age', 'found_date', 'found_location')
+
+    def compatible(self, persons, bodies):
+        """Mask of which (person, body) pairs are compatible
+
+        persons and bodies are Attributes of equal length (pairs are taken
+        elementwise) or shaped to broadcast against each other.
+        """
+        mask = np.ones(np.broadcast_shapes(persons.gender.shape, bodies.gender.shape), dtype=bool)
+        if self.gender:
+            mask &= _same_code(persons.gender, bodies.gender)
+        if self.age_tolerance is not None:
+            # nan ages compare False, so unknown ages are never excluded
+            mask &= ~(np.abs(persons.age - bodies.age) > self.age_tolerance)
+        if self.date_order:
+            mask &= ~(bodies.date < persons.date)
+        if self.region is not None:
+            mask &= _same_code(persons.region, bodies.region)
+        return mask
+
+    def compatible_rows(self, persons, person_rows, bodies, body_rows):
+        """compatible() for gallery rows person_rows[i] and body_rows[i]"""
+        return self.compatible(_take(persons, person_rows), _take(bodies, body_rows))
+
+    def candidates(self, persons, bodies):
+        """Mask of the bodies compatible with at least one of persons
+
+        Uses only per-group bounds, so it costs O(len(bodies)) however many
+        persons there are; compatible() then settles the individual pairs.
+        """
+        keep = np.ones(bodies.gender.shape[0], dtype=bool)
+        if self.gender:
+            keep &= _compatible_codes(bodies.gender, np.unique(persons.gender))
+        if self.age_tolerance is not None and not np.isnan(persons.age).any():
+            keep &= ~((bodies.age < persons.age.min() - self.age_tolerance)
+                      | (bodies.age > persons.age.max() + self.age_tolerance))
+        if self.date_order and not np.isnat(persons.date).any():
+            keep &= ~(bodies.date < persons.date.min())
+        if self.region is not None:
+            keep &= _compatible_codes(bodies.region, np.unique(persons.region))
+        return keep
+
+    def blocks(self, persons, person_rows, bodies, body_rows, block_size):
+        """Yield (person_rows, body_rows) blocks covering every compatible pair
+
+        persons/bodies are the galleries' Attributes and person_rows/body_rows
+        the rows to match; each block pairs up to block_size persons with
+        the bodies compatible with at least one of them. Persons are grouped
+        by gender, region and age before blocking so each block's candidate
+        bodies are a narrow slice of the gallery. Blocks may still hold
+        incompatible pairs: checking only the pairs that score above the
+        threshold with compatible_rows() is far cheaper than masking every
+        pair up front.
+        """
+        person_rows = np.asarray(person_rows)
+        body_rows = np.asarray(body_rows)
+        tiled = _take(persons, person_rows)
+        order = np.lexsort((tiled.date, tiled.age, tiled.region, tiled.gender))
+        person_rows = person_rows[order]
+        subset = _take(bodies, body_rows)
+
+        for start in range(0, person_rows.shape[0], block_size):
+            rows = person_rows[start:start + block_size]
+            candidates = body_rows[self.candidates(_take(persons, rows), subset)]
+            if candidates.size:
+                yield rows, candidates
@@ -1,17 +1,231 @@
 import sqlite3
 import os
 import json
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 import numpy as np
+from metrics import instrumented
+from quantization import INT8_DTYPE, STORAGE_DTYPES, int8_codes
+from gallery_cache import (MISSING_PERSON_COLUMNS, UNIDENTIFIED_BODY_COLUMNS,
+                           peek_gallery_cache)
+
+# Face encodings are stored as raw little-endian bytes in the face_encoding
+# column, with the dtype and dimension recorded alongside so rows can be
+# decoded with np.frombuffer instead of parsing JSON.
+ENCODING_DTYPE = '<f4'
+
+def encode_face_encoding(face_encoding, dtype=ENCODING_DTYPE):
+    """Convert a face encoding to (blob, dtype, dim) for storage
+    
+    int8 blobs start with the vector's float32 scale, followed by the codes.
+    """
+    if face_encoding is None:
+        return None, None, None
+    
+    if dtype == INT8_DTYPE:
+        codes, scales = int8_codes(np.asarray(face_encoding, dtype=np.float32).reshape(1, -1))
+        return scales.tobytes() + codes.tobytes(), dtype, int(codes.shape[1])
+    
+    encoding = np.ascontiguousarray(face_encoding, dtype=dtype).ravel()
+    return encoding.tobytes(), dtype, int(encoding.shape[0])
+
+@instrumented('decode_encoding')
+def decode_face_encoding(value, dtype=None, dim=None):
+    """Convert a stored face encoding back to a numpy array
+    
+    Binary float encodings are decoded zero-copy (the result is read-only);
+    int8 encodings are scaled back to float32.
+    Legacy JSON text encodings are still understood until migrated.
+    """
+    if value is None:
+        return None
+    
+    if isinstance(value, str):
+        return np.array(json.loads(value), dtype=np.float32)
+    
+    if dtype == INT8_DTYPE:
+        scale = np.frombuffer(value, dtype='<f4', count=1)[0]
+        encoding = np.frombuffer(value, dtype=INT8_DTYPE, offset=4).astype(np.float32) * scale
+    else:
+        encoding = np.frombuffer(value, dtype=dtype or ENCODING_DTYPE)
+    if dim is not None and encoding.shape[0] != dim:
+        raise ValueError(f"Stored encoding has {encoding.shape[0]} values, expected {dim}")
+    return encoding
+
+# Status of the records that take part in matching and search
+ACTIVE_STATUS = {'missing_persons': 'MISSING', 'unidentified_bodies': 'UNIDENTIFIED'}
+
+# Seconds a connection waits for another writer before raising "database is locked"
+BUSY_TIMEOUT = 30.0
+
+CONNECTION_PRAGMAS = (
+    'PRAGMA journal_mode = WAL',        # readers never block the writer
+    'PRAGMA synchronous = NORMAL',      # safe with WAL, avoids an fsync per commit
+    'PRAGMA cache_size = -65536',       # 64 MiB page cache per connection
+    'PRAGMA mmap_size = 268435456',     # read pages through a 256 MiB mapping
+    'PRAGMA temp_store = MEMORY',
+)
+
+class ConnectionPool:
+    """Long-lived SQLite connections to one database file, shared by all threads
+    
+    Connections are opened once with WAL journaling and tuned pragmas, then
+    borrowed and returned instead of being reopened for every query.
+    """
+    
+    def __init__(self, db_path, max_idle=8, busy_timeout=BUSY_TIMEOUT):
+        self.db_path = db_path
+        self.max_idle = max_idle
+        self.busy_timeout = busy_timeout
+        self.initialized = False
+        self.init_lock = threading.Lock()
+        self._idle = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+    
+    def _open(self):
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout, check_same_thread=False)
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+    
+    def _acquire(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Never reuse connections inherited across fork()
+                self._idle = []
+                self._pid = os.getpid()
+            if self._idle:
+                return self._idle.pop()
+        return self._open()
+    
+    def _release(self, conn):
+        with self._lock:
+            if len(self._idle) < self.max_idle and self._pid == os.getpid():
+                self._idle.append(conn)
+                return
+        conn.close()
+    
+    @contextmanager
+    def connection(self, write=False):
+        """Borrow a connection; commits on success and rolls back on error
+        
+        write=True takes the write lock up front (BEGIN IMMEDIATE) so the busy
+        timeout applies, instead of failing when a read upgrades to a write.
+        """
+        conn = self._acquire()
+        try:
+            if write:
+                conn.execute('BEGIN IMMEDIATE')
+            yield conn
+            if conn.in_transaction:
+                conn.commit()
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            self._release(conn)
+    
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_connection_pool(db_path):
+    """Return the process-wide connection pool for a database file"""
+    key = os.path.abspath(db_path)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(db_path)
+    return pool
+
+# Columns shown in record listings (no encodings) and the sortable ones;
+# each sortable column other than id has a (status, column, id) index
+MISSING_PERSON_LIST_COLUMNS = ('id', 'case_number', 'name', 'age', 'gender', 'last_seen_date',
+                               'last_seen_location', 'status', 'created_date')
+MISSING_PERSON_SORTS = ('id', 'name', 'case_number', 'age', 'last_seen_date', 'created_date')
+UNIDENTIFIED_BODY_LIST_COLUMNS = ('id', 'case_number', 'found_date', 'found_location',
+                                  'estimated_age', 'gender', 'status', 'created_date')
+UNIDENTIFIED_BODY_SORTS = ('id', 'case_number', 'found_date', 'found_location',
+                           'estimated_age', 'created_date')
+
+def encode_page_cursor(sort_value, record_id):
+    """Opaque URL-safe cursor for the row with this sort key"""
+    return json.dumps([sort_value, record_id], separators=(',', ':'))
+
+def decode_page_cursor(cursor):
+    """(sort value, id) from a page cursor; ValueError if it is not one"""
+    if cursor is None:
+        return None
+    try:
+        key = json.loads(cursor)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid page cursor {cursor!r}")
+    # Sort values are column values: NULL, text or a number (bool is an int
+    # subclass but never stored)
+    if (not isinstance(key, list) or len(key) != 2
+            or not isinstance(key[1], int) or isinstance(key[1], bool)
+            or isinstance(key[0], bool) or not isinstance(key[0], (type(None), str, int, float))):
+        raise ValueError(f"Invalid page cursor {cursor!r}")
+    return key[0], key[1]
+
+def _seek_segments(sort, cursor_key, ascending):
+    """(condition, params) ranges holding the rows past cursor_key, in page order
+
+    Each range is a plain seek on the raw column, so the (status, column, id)
+    indexes serve it; reading them in turn until the page is full walks the
+    listing order. SQLite sorts NULLs first, so past a NULL key ascending
+    pages go on through the remaining NULLs and then every non-NULL row, and
+    past a non-NULL key descending pages end with the NULLs.
+    """
+    if cursor_key is None:
+        return [('1', [])]
+    sort_value, record_id = cursor_key
+    if sort == 'id':
+        return [(f"id {'>' if ascending else '<'} ?", [record_id])]
+    if sort_value is None:
+        if ascending:
+            return [(f"{sort} IS NULL AND id > ?", [record_id]), (f"{sort} IS NOT NULL", [])]
+        return [(f"{sort} IS NULL AND id < ?", [record_id])]
+    if ascending:
+        return [(f"({sort}, id) > (?, ?)", [sort_value, record_id])]
+    return [(f"({sort}, id) < (?, ?)", [sort_value, record_id]), (f"{sort} IS NULL", [])]
+
+# Process-wide stats per (database file, threshold): (stats version, counts)
+_stats_cache = {}
+# Process-wide listing totals per (database file, table, filter): (stats version, count)
+_total_cache = {}
 
 class PoliceDatabase:
-    def __init__(self, db_path="police_records.db"):
+    def __init__(self, db_path="police_records.db", quantization='float32', embedding_store=False):
         self.db_path = db_path
-        self.init_database()
+        # Precision of new and migrated encodings: 'float32', 'float16' or 'int8'.
+        # Rows keep their own dtype, so databases may mix precisions.
+        self.quantization = quantization
+        # Serve galleries from memory-mapped files next to the database
+        # (shared between processes) instead of decoding every row
+        self.embedding_store = embedding_store
+        self.encoding_dtype = STORAGE_DTYPES[quantization]
+        self.pool = get_connection_pool(db_path)
+        
+        # Schema setup runs once per database file per process
+        with self.pool.init_lock:
+            if not self.pool.initialized:
+                self.init_database()
+                self.pool.initialized = True
     
     def init_database(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self.pool.connection(write=True) as conn:
+            self._create_schema(conn.cursor())
+    
+    def _create_schema(self, cursor):
         
         # Missing persons table
         cursor.execute('''
@@ -24,10 +238,14 @@ class PoliceDatabase:
                 last_seen_location TEXT,
                 description TEXT,
                 case_number TEXT UNIQUE,
-                face_encoding TEXT,
+                face_encoding BLOB,
                 photo_path TEXT,
                 status TEXT DEFAULT 'MISSING',
-                created_date TEXT DEFAULT CURRENT_TIMESTAMP
+                created_date TEXT DEFAULT CURRENT_TIMESTAMP,
+                encoding_dtype TEXT,
+                encoding_dim INTEGER,
+                raw_encoding BLOB,
+                projection_version INTEGER
             )
         ''')
         
@@ -41,10 +259,14 @@ class PoliceDatabase:
                 estimated_age INTEGER,
                 gender TEXT,
                 description TEXT,
-                face_encoding TEXT,
+                face_encoding BLOB,
                 photo_path TEXT,
                 status TEXT DEFAULT 'UNIDENTIFIED',
-                created_date TEXT DEFAULT CURRENT_TIMESTAMP
+                created_date TEXT DEFAULT CURRENT_TIMESTAMP,
+                encoding_dtype TEXT,
+                encoding_dim INTEGER,
+                raw_encoding BLOB,
+                projection_version INTEGER
             )
         ''')
         
@@ -63,94 +285,671 @@ class PoliceDatabase:
             )
         ''')
         
-        conn.commit()
-        conn.close()
+        # One row per (missing person, body) pair; re-scoring a pair updates it
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_matches_pair'")
+        if cursor.fetchone() is None:
+            # Older databases may hold duplicates from repeated match runs
+            cursor.execute('''
+                DELETE FROM matches WHERE id NOT IN (
+                    SELECT MIN(id) FROM matches
+                    GROUP BY missing_person_id, unidentified_body_id
+                )
+            ''')
+            cursor.execute('''
+                CREATE UNIQUE INDEX idx_matches_pair
+                ON matches (missing_person_id, unidentified_body_id)
+            ''')
+        
+        # Dashboard and listing filters: active records, strong matches, and
+        # matches per body (per person is served by idx_matches_pair's prefix)
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_missing_persons_status ON missing_persons (status)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_unidentified_bodies_status ON unidentified_bodies (status)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_matches_confidence ON matches (confidence_score)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_matches_body ON matches (unidentified_body_id)')
+        
+        # Sorted listings seek on (column, id) within a status; sorting by id
+        # is served by the status indexes, which end in the rowid
+        for table, sorts in (('missing_persons', MISSING_PERSON_SORTS),
+                             ('unidentified_bodies', UNIDENTIFIED_BODY_SORTS)):
+            for sort in sorts:
+                if sort != 'id':
+                    cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_status_{sort} '
+                                   f'ON {table} (status, {sort}, id)')
+        
+        # Change counter for cached stats; bumped by any write that can change a count
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS stats_state (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL
+            )
+        ''')
+        cursor.execute('INSERT OR IGNORE INTO stats_state (id, version) VALUES (1, 0)')
+        
+        for table, update_columns in (('missing_persons', 'status'), ('unidentified_bodies', 'status'),
+                                      ('matches', 'confidence_score, missing_person_id, unidentified_body_id')):
+            for event in ('INSERT', 'DELETE', f'UPDATE OF {update_columns}'):
+                trigger_name = f"{table}_{event.split()[0].lower()}_stats"
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS {trigger_name}
+                    AFTER {event} ON {table}
+                    BEGIN
+                        UPDATE stats_state SET version = version + 1 WHERE id = 1;
+                    END
+                ''')
+        
+        # Highest record ids already covered by a match run
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS match_state (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+        ''')
+        
+        # Projection version the stored embeddings are in (0: raw encodings),
+        # switched in the same transaction that re-projects them
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'projection_state'")
+        if cursor.fetchone() is None:
+            cursor.execute('''
+                CREATE TABLE projection_state (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    version INTEGER NOT NULL
+                )
+            ''')
+            # Older databases only record the version on each row
+            cursor.execute('''
+                INSERT INTO projection_state (id, version)
+                SELECT 1, COALESCE(MAX(version), 0) FROM (
+                    SELECT MAX(projection_version) AS version FROM missing_persons
+                    UNION ALL
+                    SELECT MAX(projection_version) FROM unidentified_bodies
+                )
+            ''')
+        
+        # Change counter for the in-memory gallery cache, bumped by triggers so
+        # writes from any connection or process invalidate stale caches
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS gallery_state (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL
+            )
+        ''')
+        cursor.execute('INSERT OR IGNORE INTO gallery_state (id, version) VALUES (1, 0)')
+        
+        for table in ('missing_persons', 'unidentified_bodies'):
+            for event in ('INSERT', 'DELETE', 'UPDATE OF status, face_encoding'):
+                trigger_name = f"{table}_{event.split()[0].lower()}_version"
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS {trigger_name}
+                    AFTER {event} ON {table}
+                    BEGIN
+                        UPDATE gallery_state SET version = version + 1 WHERE id = 1;
+                    END
+                ''')
+        
+        # Per-table counter of changes that are not plain inserts: on-disk
+        # embedding stores can append inserts but must be rebuilt after these
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS embedding_state (
+                name TEXT PRIMARY KEY,
+                layout INTEGER NOT NULL
+            )
+        ''')
+        
+        for table in ('missing_persons', 'unidentified_bodies'):
+            cursor.execute('INSERT OR IGNORE INTO embedding_state (name, layout) VALUES (?, 0)', (table,))
+            for event, condition in (('DELETE', ''),
+                                     ('UPDATE OF status, face_encoding',
+                                      'WHEN OLD.status IS NOT NEW.status '
+                                      'OR OLD.face_encoding IS NOT NEW.face_encoding')):
+                trigger_name = f"{table}_{event.split()[0].lower()}_layout"
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS {trigger_name}
+                    AFTER {event} ON {table} {condition}
+                    BEGIN
+                        UPDATE embedding_state SET layout = layout + 1 WHERE name = '{table}';
+                    END
+                ''')
+        
+        # Older databases lack the binary encoding and projection columns
+        added_columns = (('encoding_dtype', 'TEXT'), ('encoding_dim', 'INTEGER'),
+                         ('raw_encoding', 'BLOB'), ('projection_version', 'INTEGER'))
+        for table in ('missing_persons', 'unidentified_bodies'):
+            cursor.execute(f'PRAGMA table_info({table})')
+            columns = [row[1] for row in cursor.fetchall()]
+            for column, column_type in added_columns:
+                if column not in columns:
+                    cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+    
+    def migrate_encodings(self, batch_size=500, vacuum=True):
+        """Convert legacy JSON text encodings, and binary encodings stored at
+        another precision, to this database's encoding dtype in place"""
+        converted = {}
+        
+        with self.pool.connection(write=True) as conn:
+            cursor = conn.cursor()
+            
+            for table in ('missing_persons', 'unidentified_bodies'):
+                cursor.execute(f'''
+                    SELECT id FROM {table}
+                    WHERE typeof(face_encoding) = 'text'
+                       OR (face_encoding IS NOT NULL AND encoding_dtype IS NOT ?)
+                ''', (self.encoding_dtype,))
+                record_ids = [row[0] for row in cursor.fetchall()]
+                
+                for start in range(0, len(record_ids), batch_size):
+                    batch_ids = record_ids[start:start + batch_size]
+                    placeholders = ','.join('?' * len(batch_ids))
+                    cursor.execute(f'''
+                        SELECT id, face_encoding, encoding_dtype, encoding_dim
+                        FROM {table} WHERE id IN ({placeholders})
+                    ''', batch_ids)
+                    
+                    updates = []
+                    for record_id, encoding, encoding_dtype, encoding_dim in cursor.fetchall():
+                        if isinstance(encoding, str):
+                            encoding_dtype = encoding_dim = None
+                        blob, dtype, dim = encode_face_encoding(
+                            decode_face_encoding(encoding, encoding_dtype, encoding_dim),
+                            self.encoding_dtype)
+                        updates.append((blob, dtype, dim, record_id))
+                    
+                    cursor.executemany(f'''
+                        UPDATE {table}
+                        SET face_encoding = ?, encoding_dtype = ?, encoding_dim = ?
+                        WHERE id = ?
+                    ''', updates)
+                
+                converted[table] = len(record_ids)
+        
+        if vacuum:
+            # Reclaim the space freed by the much smaller binary encodings
+            with self.pool.connection() as conn:
+                conn.execute('VACUUM')
+        return converted
+    
+    def iter_raw_encodings(self, input_dim):
+        """Yield the raw (pre-projection) encoding of every stored record
+        
+        Rows that were never projected still hold their raw encoding in
+        face_encoding; projected rows keep it in raw_encoding.
+        """
+        with self.pool.connection() as conn:
+            for table in ('missing_persons', 'unidentified_bodies'):
+                cursor = conn.execute(f'''
+                    SELECT raw_encoding, face_encoding, encoding_dtype, encoding_dim
+                    FROM {table}
+                    WHERE raw_encoding IS NOT NULL OR encoding_dim = ?
+                ''', (input_dim,))
+                for raw_blob, encoding_blob, encoding_dtype, encoding_dim in cursor:
+                    if raw_blob is not None:
+                        yield decode_face_encoding(raw_blob)
+                    else:
+                        yield decode_face_encoding(encoding_blob, encoding_dtype, encoding_dim)
+    
+    def reproject_encodings(self, projection, batch_size=500):
+        """Re-project every stored encoding with a newly fitted projection
+        
+        Runs as one transaction that also makes projection.version the
+        active one, so readers switch from the old embeddings and model to
+        the new ones atomically. The model file must already be saved.
+        Returns the number of rows updated per table.
+        """
+        reprojected = {}
+        
+        with self.pool.connection(write=True) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('SELECT version FROM projection_state WHERE id = 1')
+            active_version = cursor.fetchone()[0]
+            if projection.version <= active_version:
+                raise ValueError(f"Projection v{projection.version} is not newer than "
+                                 f"the active v{active_version}")
+            cursor.execute('UPDATE projection_state SET version = ? WHERE id = 1', (projection.version,))
+            
+            for table in ('missing_persons', 'unidentified_bodies'):
+                cursor.execute(f'''
+                    SELECT id FROM {table}
+                    WHERE raw_encoding IS NOT NULL OR encoding_dim = ?
+                ''', (projection.input_dim,))
+                record_ids = [row[0] for row in cursor.fetchall()]
+                
+                for start in range(0, len(record_ids), batch_size):
+                    batch_ids = record_ids[start:start + batch_size]
+                    placeholders = ','.join('?' * len(batch_ids))
+                    cursor.execute(f'''
+                        SELECT id, raw_encoding, face_encoding, encoding_dtype, encoding_dim
+                        FROM {table} WHERE id IN ({placeholders})
+                    ''', batch_ids)
+                    
+                    rows = cursor.fetchall()
+                    raw_encodings = np.vstack([
+                        decode_face_encoding(raw_blob) if raw_blob is not None
+                        else decode_face_encoding(encoding_blob, encoding_dtype, encoding_dim)
+                        for _, raw_blob, encoding_blob, encoding_dtype, encoding_dim in rows
+                    ])
+                    projected = projection.transform(raw_encodings)
+                    
+                    updates = []
+                    for row, raw_encoding, encoding in zip(rows, raw_encodings, projected):
+                        blob, dtype, dim = encode_face_encoding(encoding, self.encoding_dtype)
+                        updates.append((blob, dtype, dim, encode_face_encoding(raw_encoding)[0],
+                                        projection.version, row[0]))
+                    
+                    cursor.executemany(f'''
+                        UPDATE {table}
+                        SET face_encoding = ?, encoding_dtype = ?, encoding_dim = ?,
+                            raw_encoding = ?, projection_version = ?
+                        WHERE id = ?
+                    ''', updates)
+                
+                reprojected[table] = len(record_ids)
+        
+        return reprojected
     
     def add_missing_person(self, name, age, gender, last_seen_date, last_seen_location, 
-                          description, case_number, face_encoding, photo_path):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+                          description, case_number, face_encoding, photo_path,
+                          raw_encoding=None, projection_version=None):
+        with self._gallery_write() as (cursor, cache_updates):
+            return self._insert_missing_person(
+                cursor, cache_updates, name, age, gender, last_seen_date, last_seen_location,
+                description, case_number, face_encoding, photo_path,
+                raw_encoding, projection_version)
+    
+    def add_missing_persons(self, records):
+        """Insert many missing persons in a single transaction
         
-        encoding_str = json.dumps(face_encoding.tolist()) if face_encoding is not None else None
+        Each record is a dict of add_missing_person's arguments. Returns the
+        new ids; if any insert fails the whole batch is rolled back.
+        """
+        with self._gallery_write() as (cursor, cache_updates):
+            return [self._insert_missing_person(cursor, cache_updates, **record) for record in records]
+    
+    @instrumented('db_insert')
+    def _insert_missing_person(self, cursor, cache_updates, name, age, gender, last_seen_date, last_seen_location,
+                               description, case_number, face_encoding, photo_path,
+                               raw_encoding=None, projection_version=None):
+        encoding_blob, encoding_dtype, encoding_dim = encode_face_encoding(face_encoding, self.encoding_dtype)
+        raw_blob = encode_face_encoding(raw_encoding)[0]
         
         cursor.execute('''
             INSERT INTO missing_persons 
             (name, age, gender, last_seen_date, last_seen_location, description, 
-             case_number, face_encoding, photo_path)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+             case_number, face_encoding, photo_path, encoding_dtype, encoding_dim,
+             raw_encoding, projection_version)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (name, age, gender, last_seen_date, last_seen_location, description, 
-              case_number, encoding_str, photo_path))
+              case_number, encoding_blob, photo_path, encoding_dtype, encoding_dim,
+              raw_blob, projection_version))
         
-        conn.commit()
         person_id = cursor.lastrowid
-        conn.close()
+        self._record_insert(cursor, cache_updates, 'missing_persons', MISSING_PERSON_COLUMNS,
+                            person_id, face_encoding)
         return person_id
     
     def add_unidentified_body(self, case_number, found_date, found_location, 
-                             estimated_age, gender, description, face_encoding, photo_path):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+                             estimated_age, gender, description, face_encoding, photo_path,
+                             raw_encoding=None, projection_version=None):
+        with self._gallery_write() as (cursor, cache_updates):
+            return self._insert_unidentified_body(
+                cursor, cache_updates, case_number, found_date, found_location, estimated_age,
+                gender, description, face_encoding, photo_path,
+                raw_encoding, projection_version)
+    
+    def add_unidentified_bodies(self, records):
+        """Insert many unidentified bodies in a single transaction
         
-        encoding_str = json.dumps(face_encoding.tolist()) if face_encoding is not None else None
+        Each record is a dict of add_unidentified_body's arguments. Returns the
+        new ids; if any insert fails the whole batch is rolled back.
+        """
+        with self._gallery_write() as (cursor, cache_updates):
+            return [self._insert_unidentified_body(cursor, cache_updates, **record) for record in records]
+    
+    @instrumented('db_insert')
+    def _insert_unidentified_body(self, cursor, cache_updates, case_number, found_date, found_location,
+                                  estimated_age, gender, description, face_encoding, photo_path,
+                                  raw_encoding=None, projection_version=None):
+        encoding_blob, encoding_dtype, encoding_dim = encode_face_encoding(face_encoding, self.encoding_dtype)
+        raw_blob = encode_face_encoding(raw_encoding)[0]
         
         cursor.execute('''
             INSERT INTO unidentified_bodies 
             (case_number, found_date, found_location, estimated_age, gender, 
-             description, face_encoding, photo_path)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+             description, face_encoding, photo_path, encoding_dtype, encoding_dim,
+             raw_encoding, projection_version)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (case_number, found_date, found_location, estimated_age, gender, 
-              description, encoding_str, photo_path))
+              description, encoding_blob, photo_path, encoding_dtype, encoding_dim,
+              raw_blob, projection_version))
         
-        conn.commit()
         body_id = cursor.lastrowid
-        conn.close()
+        self._record_insert(cursor, cache_updates, 'unidentified_bodies', UNIDENTIFIED_BODY_COLUMNS,
+                            body_id, face_encoding)
         return body_id
     
+    def get_case_numbers(self, table):
+        """Set of case numbers already stored in missing_persons or unidentified_bodies"""
+        if table not in ('missing_persons', 'unidentified_bodies'):
+            raise ValueError(f"Unknown record table: {table}")
+        
+        with self.pool.connection() as conn:
+            cursor = conn.execute(f'SELECT case_number FROM {table}')
+            return {row[0] for row in cursor.fetchall()}
+    
+    @instrumented('db_list_records')
     def get_all_missing_persons(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM missing_persons WHERE status = "MISSING"')
-        results = cursor.fetchall()
-        conn.close()
-        return results
+        with self.pool.connection() as conn:
+            cursor = conn.execute('SELECT * FROM missing_persons WHERE status = "MISSING"')
+            return cursor.fetchall()
     
+    @instrumented('db_list_records')
     def get_all_unidentified_bodies(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM unidentified_bodies WHERE status = "UNIDENTIFIED"')
-        results = cursor.fetchall()
-        conn.close()
-        return results
+        with self.pool.connection() as conn:
+            cursor = conn.execute('SELECT * FROM unidentified_bodies WHERE status = "UNIDENTIFIED"')
+            return cursor.fetchall()
+    
+    def get_stats(self, threshold=0.6):
+        """Return active record and potential match counts
+        
+        Counts come from indexed COUNT(*) queries and are cached per database
+        file until a write changes them, so repeated calls cost one lookup.
+        """
+        key = (os.path.abspath(self.db_path), threshold)
+        with self.pool.connection() as conn:
+            version = conn.execute('SELECT version FROM stats_state WHERE id = 1').fetchone()[0]
+            cached = _stats_cache.get(key)
+            if cached is not None and cached[0] == version:
+                return dict(cached[1])
+            
+            stats = {
+                'missing_persons': conn.execute(
+                    'SELECT COUNT(*) FROM missing_persons WHERE status = ?',
+                    (ACTIVE_STATUS['missing_persons'],)).fetchone()[0],
+                'unidentified_bodies': conn.execute(
+                    'SELECT COUNT(*) FROM unidentified_bodies WHERE status = ?',
+                    (ACTIVE_STATUS['unidentified_bodies'],)).fetchone()[0],
+                'potential_matches': conn.execute(
+                    'SELECT COUNT(*) FROM matches WHERE confidence_score >= ?',
+                    (threshold,)).fetchone()[0]
+            }
+        
+        # The version was read before the counts, so a write racing them can
+        # only make the next call recompute, never serve stale counts
+        _stats_cache[key] = (version, stats)
+        return dict(stats)
+    
+    def list_missing_persons(self, limit=50, after=None, before=None, sort='id', descending=False,
+                             status='MISSING', gender=None, search=None):
+        """One page of missing persons with display columns only; see _list_records"""
+        return self._list_records('missing_persons', MISSING_PERSON_LIST_COLUMNS, MISSING_PERSON_SORTS,
+                                  ('name', 'case_number'), limit, after, before, sort, descending,
+                                  status, gender, search)
+    
+    def list_unidentified_bodies(self, limit=50, after=None, before=None, sort='id', descending=False,
+                                 status='UNIDENTIFIED', gender=None, search=None):
+        """One page of unidentified bodies with display columns only; see _list_records"""
+        return self._list_records('unidentified_bodies', UNIDENTIFIED_BODY_LIST_COLUMNS,
+                                  UNIDENTIFIED_BODY_SORTS, ('case_number', 'found_location'),
+                                  limit, after, before, sort, descending, status, gender, search)
+    
+    @instrumented('db_list_records')
+    def _list_records(self, table, columns, sorts, search_columns, limit, after, before, sort,
+                      descending, status, gender, search):
+        """Keyset-paginated listing
+        
+        Rows are ordered by (sort column, id), NULLs first. after/before are
+        page cursors returned by a previous call ('next' / 'prev'); pages are
+        found by seeking past the cursor's key in a (status, column, id)
+        index instead of OFFSET. status=None lists every status; search
+        matches a substring of the search columns. Returns {'records',
+        'total', 'next', 'prev'} where records are dicts and next/prev are
+        None at either end; total is cached until a record is added, removed
+        or changes status. Raises ValueError for an unknown sort or a
+        malformed cursor.
+        """
+        if sort not in sorts:
+            raise ValueError(f"Cannot sort {table} by {sort!r}; expected one of {sorts}")
+        
+        conditions, params = [], []
+        if status is not None:
+            conditions.append('status = ?')
+            params.append(status)
+        if gender:
+            conditions.append('gender = ?')
+            params.append(gender)
+        if search:
+            conditions.append('(' + ' OR '.join(f"{column} LIKE ?" for column in search_columns) + ')')
+            params.extend([f"%{search}%"] * len(search_columns))
+        
+        where = ' AND '.join(conditions) or '1'
+        backwards = before is not None
+        cursor_key = decode_page_cursor(before if backwards else after)
+        # Walking backwards reverses the order, then the page is flipped back
+        ascending = descending == backwards
+        
+        direction = 'ASC' if ascending else 'DESC'
+        order = f"id {direction}" if sort == 'id' else f"{sort} {direction}, id {direction}"
+        
+        total_key = (os.path.abspath(self.db_path), table, where, tuple(params))
+        with self.pool.connection() as conn:
+            # Only inserts, deletes and status changes alter a listing's
+            # count, and each of those bumps the stats version
+            version = conn.execute('SELECT version FROM stats_state WHERE id = 1').fetchone()[0]
+            cached = _total_cache.get(total_key)
+            if cached is not None and cached[0] == version:
+                total = cached[1]
+            else:
+                total = conn.execute(f'SELECT COUNT(*) FROM {table} WHERE {where}', params).fetchone()[0]
+                _total_cache[total_key] = (version, total)
+            rows = []
+            for seek, seek_params in _seek_segments(sort, cursor_key, ascending):
+                if len(rows) > limit:
+                    break
+                cursor = conn.execute(f'''
+                    SELECT {', '.join(columns)}, {sort}
+                    FROM {table} WHERE {where} AND {seek}
+                    ORDER BY {order}
+                    LIMIT ?
+                ''', params + seek_params + [limit + 1 - len(rows)])
+                rows.extend(cursor.fetchall())
+        
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if backwards:
+            rows.reverse()
+        
+        records = [dict(zip(columns, row[:-1])) for row in rows]
+        first_key = encode_page_cursor(rows[0][-1], rows[0][0]) if rows else None
+        last_key = encode_page_cursor(rows[-1][-1], rows[-1][0]) if rows else None
+        if backwards:
+            next_cursor, prev_cursor = last_key, first_key if more else None
+        else:
+            next_cursor, prev_cursor = last_key if more else None, first_key if cursor_key else None
+        
+        return {'records': records, 'total': total, 'next': next_cursor, 'prev': prev_cursor}
+    
+    def get_projection_version(self):
+        """Projection version the stored embeddings are in, 0 for raw encodings"""
+        with self.pool.connection() as conn:
+            cursor = conn.execute('SELECT version FROM projection_state WHERE id = 1')
+            return cursor.fetchone()[0]
+    
+    def get_gallery_version(self):
+        """Current value of the change counter bumped on every record write"""
+        with self.pool.connection() as conn:
+            cursor = conn.execute('SELECT version FROM gallery_state WHERE id = 1')
+            return cursor.fetchone()[0]
+    
+    def get_missing_person_gallery(self, columns):
+        """Yield (record dict, encoding) for every active missing person"""
+        return self._get_gallery('missing_persons', 'MISSING', columns)
+    
+    def get_unidentified_body_gallery(self, columns):
+        """Yield (record dict, encoding) for every active unidentified body"""
+        return self._get_gallery('unidentified_bodies', 'UNIDENTIFIED', columns)
+    
+    def _get_gallery(self, table, status, columns):
+        with self.pool.connection() as conn:
+            cursor = conn.execute(f'''
+                SELECT {', '.join(columns)}, face_encoding, encoding_dtype, encoding_dim
+                FROM {table} WHERE status = ? ORDER BY id
+            ''', (status,))
+            
+            for row in cursor:
+                record = dict(zip(columns, row[:len(columns)]))
+                yield record, decode_face_encoding(*row[len(columns):])
+    
+    def get_gallery_records(self, table, columns):
+        """Return [(record dict, has encoding)] for every active record, by id
+        
+        Reads only the small columns; used when encodings come from an
+        EmbeddingStore instead of the face_encoding blobs.
+        """
+        with self.pool.connection() as conn:
+            cursor = conn.execute(f'''
+                SELECT {', '.join(columns)}, face_encoding IS NOT NULL
+                FROM {table} WHERE status = ? ORDER BY id
+            ''', (ACTIVE_STATUS[table],))
+            return [(dict(zip(columns, row[:-1])), bool(row[-1])) for row in cursor]
+    
+    @instrumented('embedding_store_sync')
+    def sync_embedding_store(self, store):
+        """Append new active encodings of store.table to an EmbeddingStore
+        
+        Holds the write lock so concurrent processes never append the same
+        rows twice. The whole table is rewritten after a delete, status change
+        or re-encoding. Returns the gallery version the store now reflects.
+        """
+        with self.pool.connection(write=True) as conn:
+            version = conn.execute('SELECT version FROM gallery_state WHERE id = 1').fetchone()[0]
+            if store.is_current(version):
+                return version
+            
+            layout = conn.execute('SELECT layout FROM embedding_state WHERE name = ?',
+                                  (store.table,)).fetchone()[0]
+            cursor = conn.execute(f'''
+                SELECT id, face_encoding, encoding_dtype, encoding_dim FROM {store.table}
+                WHERE status = ? AND face_encoding IS NOT NULL AND id > ?
+                ORDER BY id
+            ''', (ACTIVE_STATUS[store.table], store.max_id(layout)))
+            store.append(layout, version,
+                         ((row[0], decode_face_encoding(*row[1:])) for row in cursor))
+            return version
+    
+    @contextmanager
+    def _gallery_write(self):
+        """Write transaction yielding (cursor, cache_updates)
+        
+        Gallery cache updates queued in cache_updates are applied only once
+        the transaction has committed, so a rolled-back batch never leaves
+        its rows (or a version ahead of the database) in the cache.
+        """
+        cache_updates = []
+        with self.pool.connection(write=True) as conn:
+            yield conn.cursor(), cache_updates
+        for update in cache_updates:
+            update()
+    
+    def _record_insert(self, cursor, cache_updates, table, columns, record_id, face_encoding):
+        # Runs inside the insert transaction, so the version read here is the
+        # one produced by this insert's trigger
+        cache = peek_gallery_cache(self.db_path)
+        if cache is None:
+            return
+        
+        cursor.execute('SELECT version FROM gallery_state WHERE id = 1')
+        version = cursor.fetchone()[0]
+        cursor.execute(f"SELECT {', '.join(columns)} FROM {table} WHERE id = ?", (record_id,))
+        record = dict(zip(columns, cursor.fetchone()))
+        cache_updates.append(lambda: cache.record_insert(table, version, record, face_encoding))
+    
+    def update_missing_person_status(self, person_id, status):
+        """Change a missing person's status, e.g. to 'FOUND' once identified"""
+        return self._update_status('missing_persons', 'MISSING', person_id, status)
+    
+    def update_unidentified_body_status(self, body_id, status):
+        """Change an unidentified body's status, e.g. to 'IDENTIFIED'"""
+        return self._update_status('unidentified_bodies', 'UNIDENTIFIED', body_id, status)
+    
+    def _update_status(self, table, active_status, record_id, status):
+        with self._gallery_write() as (cursor, cache_updates):
+            cursor.execute(f'SELECT status FROM {table} WHERE id = ?', (record_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return False
+            
+            cursor.execute(f'UPDATE {table} SET status = ? WHERE id = ?', (status, record_id))
+            
+            cache = peek_gallery_cache(self.db_path)
+            if cache is not None:
+                cursor.execute('SELECT version FROM gallery_state WHERE id = 1')
+                version = cursor.fetchone()[0]
+                cache_updates.append(lambda: cache.record_status_change(
+                    table, version, record_id, was_active=row[0] == active_status,
+                    active=status == active_status))
+            return True
     
     def add_match(self, missing_person_id, unidentified_body_id, confidence_score, notes=""):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        """Insert a match, or refresh the score of an existing one for the same pair"""
+        return self.add_matches([(missing_person_id, unidentified_body_id, confidence_score, notes)])[0]
+    
+    @instrumented('db_add_matches')
+    def add_matches(self, matches):
+        """Upsert many matches in a single transaction
         
-        cursor.execute('''
-            INSERT INTO matches 
-            (missing_person_id, unidentified_body_id, confidence_score, notes)
-            VALUES (?, ?, ?, ?)
-        ''', (missing_person_id, unidentified_body_id, confidence_score, notes))
+        matches is an iterable of (missing_person_id, unidentified_body_id,
+        confidence_score, notes) tuples. Returns the match ids in the same order.
+        """
+        matches = list(matches)
+        if not matches:
+            return []
         
-        conn.commit()
-        match_id = cursor.lastrowid
-        conn.close()
-        return match_id
+        with self.pool.connection(write=True) as conn:
+            cursor = conn.cursor()
+            
+            # Investigator notes on verified matches are never overwritten
+            cursor.executemany('''
+                INSERT INTO matches 
+                (missing_person_id, unidentified_body_id, confidence_score, notes)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (missing_person_id, unidentified_body_id) DO UPDATE SET
+                    confidence_score = excluded.confidence_score,
+                    match_date = CURRENT_TIMESTAMP,
+                    notes = CASE WHEN matches.verified THEN matches.notes ELSE excluded.notes END
+            ''', matches)
+            
+            match_ids = []
+            for missing_person_id, unidentified_body_id, _, _ in matches:
+                cursor.execute('''
+                    SELECT id FROM matches
+                    WHERE missing_person_id = ? AND unidentified_body_id = ?
+                ''', (missing_person_id, unidentified_body_id))
+                match_ids.append(cursor.fetchone()[0])
+            return match_ids
+    
+    def get_match_watermarks(self):
+        """Return (missing person id, body id) up to which matching has run"""
+        with self.pool.connection() as conn:
+            state = dict(conn.execute('SELECT name, value FROM match_state').fetchall())
+        return state.get('missing_persons', 0), state.get('unidentified_bodies', 0)
+    
+    def set_match_watermarks(self, missing_person_id, unidentified_body_id):
+        with self.pool.connection(write=True) as conn:
+            conn.executemany('''
+                INSERT INTO match_state (name, value) VALUES (?, ?)
+                ON CONFLICT (name) DO UPDATE SET value = MAX(value, excluded.value)
+            ''', [('missing_persons', missing_person_id),
+                  ('unidentified_bodies', unidentified_body_id)])
     
+    @instrumented('db_get_matches')
     def get_matches(self, threshold=0.6):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT m.*, mp.name, mp.case_number as mp_case, 
-                   ub.case_number as ub_case, ub.found_location
-            FROM matches m
-            JOIN missing_persons mp ON m.missing_person_id = mp.id
-            JOIN unidentified_bodies ub ON m.unidentified_body_id = ub.id
-            WHERE m.confidence_score >= ?
-            ORDER BY m.confidence_score DESC
-        ''', (threshold,))
-        
-        results = cursor.fetchall()
-        conn.close()
-        return results
\ No newline at end of file
+        with self.pool.connection() as conn:
+            cursor = conn.execute('''
+                SELECT m.*, mp.name, mp.case_number as mp_case, 
+                       ub.case_number as ub_case, ub.found_location
+                FROM matches m
+                JOIN missing_persons mp ON m.missing_person_id = mp.id
+                JOIN unidentified_bodies ub ON m.unidentified_body_id = ub.id
+                WHERE m.confidence_score >= ?
+                ORDER BY m.confidence_score DESC
+            ''', (threshold,))
+            return cursor.fetchall()
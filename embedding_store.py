@@ -0,0 +1,168 @@
+import json
+import os
+import numpy as np
+from matching import normalize_rows
+from quantization import STORAGE_DTYPES, QuantizedMatrix, quantize_rows
+
+# Encodings normalized and written per chunk when (re)building a store
+WRITE_CHUNK_ROWS = 4096
+
+class EmbeddingStore:
+    """Append-only on-disk matrix of one gallery's normalized encodings
+
+    Rows are kept in raw binary files next to the database: the encodings
+    (at the gallery's precision), their record ids and, for int8, the
+    per-row scales. A small JSON header says how many rows are valid and
+    which database state they reflect. Readers map the files read-only with
+    np.memmap, so every worker process shares one copy in the OS page cache
+    and startup costs a mmap instead of decoding every row.
+
+    Inserts only ever append. Deletes, status changes and re-encodings bump
+    the table's layout counter in SQLite, and the next sync rewrites the
+    store under a new generation number so existing mappings stay valid.
+    Writers serialize on the database's write lock (see
+    PoliceDatabase.sync_embedding_store).
+    """
+
+    def __init__(self, db_path, table, quantization='float32'):
+        self.table = table
+        self.quantization = quantization
+        self.dtype = STORAGE_DTYPES[quantization]
+        self.prefix = f"{os.path.splitext(db_path)[0]}.{table}.{quantization}"
+        self.header_path = self.prefix + '.json'
+
+    def read_header(self):
+        try:
+            with open(self.header_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_header(self, header):
+        tmp_path = self.header_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(header, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.header_path)
+
+    def _paths(self, generation):
+        base = f"{self.prefix}.{generation}"
+        return base + '.ids', base + '.emb', base + '.scales'
+
+    def is_current(self, version):
+        """True if the store already reflects gallery version `version`"""
+        header = self.read_header()
+        return header is not None and header['version'] == version
+
+    def append(self, layout, version, rows):
+        """Write (record_id, encoding) rows with ids above the stored ones
+
+        A layout change (or a missing store) starts a new generation from
+        scratch; rows must then cover the whole table. Must be called with
+        the database write lock held.
+        """
+        header = self.read_header()
+        if header is None or header['layout'] != layout:
+            old_generation = header['generation'] if header else None
+            header = {'generation': (old_generation or 0) + 1, 'layout': layout,
+                      'count': 0, 'dim': None, 'max_id': 0}
+            for path in self._paths(header['generation']):
+                open(path, 'wb').close()
+        else:
+            old_generation = None
+
+        ids_path, matrix_path, scales_path = self._paths(header['generation'])
+        with open(ids_path, 'r+b') as ids_file, open(matrix_path, 'r+b') as matrix_file, \
+                open(scales_path, 'r+b') as scales_file:
+            # Drop anything past the last committed row (an interrupted append)
+            for f, row_bytes in ((ids_file, 8), (matrix_file, None), (scales_file, 4)):
+                if row_bytes is None:
+                    row_bytes = (header['dim'] or 0) * np.dtype(self.dtype).itemsize
+                f.truncate(header['count'] * row_bytes)
+                f.seek(0, os.SEEK_END)
+
+            for chunk_ids, chunk in _chunks(rows):
+                if header['dim'] is None:
+                    header['dim'] = chunk.shape[1]
+                elif chunk.shape[1] != header['dim']:
+                    raise ValueError(f"Encoding has {chunk.shape[1]} values, "
+                                     f"store uses {header['dim']}")
+
+                matrix = quantize_rows(normalize_rows(chunk), self.quantization)
+                ids_file.write(np.asarray(chunk_ids, dtype='<i8').tobytes())
+                if isinstance(matrix, QuantizedMatrix):
+                    matrix_file.write(matrix.codes.tobytes())
+                    if matrix.scales is not None:
+                        scales_file.write(matrix.scales.astype('<f4').tobytes())
+                else:
+                    matrix_file.write(matrix.astype(self.dtype, copy=False).tobytes())
+                header['count'] += len(chunk_ids)
+                header['max_id'] = int(chunk_ids[-1])
+
+            for f in (ids_file, matrix_file, scales_file):
+                f.flush()
+                os.fsync(f.fileno())
+
+        header['version'] = version
+        self._write_header(header)
+
+        if old_generation is not None:
+            # Processes still mapping the old files keep their pages until they remap
+            for path in self._paths(old_generation):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def max_id(self, layout):
+        """Highest stored record id, or 0 if the store must be rebuilt for layout"""
+        header = self.read_header()
+        if header is None or header['layout'] != layout:
+            return 0
+        return header['max_id']
+
+    def open(self):
+        """Map the store read-only; returns (ids, matrix) or None if there is no store
+
+        matrix is a float32 memmap, or a QuantizedMatrix over memmapped codes.
+        """
+        header = self.read_header()
+        while header is not None:
+            try:
+                return self._map(header)
+            except FileNotFoundError:
+                # A rebuild removed this generation after its header was read
+                latest = self.read_header()
+                if latest is not None and latest['generation'] == header['generation']:
+                    raise
+                header = latest
+        return None
+
+    def _map(self, header):
+        count, dim = header['count'], header['dim'] or 0
+        ids_path, matrix_path, scales_path = self._paths(header['generation'])
+        if count == 0:
+            return np.zeros(0, dtype=np.int64), quantize_rows(np.zeros((0, dim), dtype=np.float32),
+                                                              self.quantization)
+
+        ids = np.memmap(ids_path, dtype='<i8', mode='r', shape=(count,))
+        codes = np.memmap(matrix_path, dtype=self.dtype, mode='r', shape=(count, dim))
+        if self.quantization == 'float32':
+            return ids, codes
+        scales = None
+        if self.quantization == 'int8':
+            scales = np.memmap(scales_path, dtype='<f4', mode='r', shape=(count,))
+        return ids, QuantizedMatrix(codes, scales)
+
+def _chunks(rows):
+    """Group (record_id, encoding) rows into (ids, float32 matrix) chunks"""
+    chunk_ids, encodings = [], []
+    for record_id, encoding in rows:
+        chunk_ids.append(record_id)
+        encodings.append(np.asarray(encoding, dtype=np.float32))
+        if len(chunk_ids) == WRITE_CHUNK_ROWS:
+            yield chunk_ids, np.vstack(encodings)
+            chunk_ids, encodings = [], []
+    if chunk_ids:
+        yield chunk_ids, np.vstack(encodings)
@@ -1,24 +1,150 @@
 import cv2
 import numpy as np
 import os
-from PIL import Image
-import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from sklearn.metrics.pairwise import cosine_similarity
+from ann_index import IVFIndex, index_path
 from database import PoliceDatabase
+from feature_cache import DEFAULT_MAX_ENTRIES, FeatureCache, feature_cache_path
+from gallery_cache import get_gallery_cache
+from image_io import decode_image, describe_source, read_image_data
+from metrics import increment, instrumented, record_cache, timed
+from matching import (DEFAULT_BLOCK_SIZE, iter_candidate_pairs, iter_similar_pairs, normalize_rows,
+                      similarity_matrix, top_k)
+from parallel_matching import DEFAULT_SHARD_SIZE, ParallelMatcher
+from projection import (DEFAULT_COMPONENTS, MAX_FIT_SAMPLES, PCAProjection, legacy_projection_path,
+                        load_projection, projection_path)
+
+# Faces are resized to this before extraction; raw encodings have w*h values
+FACE_SIZE = (100, 100)
+RAW_ENCODING_DIM = FACE_SIZE[0] * FACE_SIZE[1]
+# Bump whenever detection or extraction code changes what a photo encodes to,
+# so cached encodings from older code are never reused
+EXTRACTOR_VERSION = 1
+
+# Haar cascade defaults (detectMultiScale's scaleFactor and minNeighbors)
+DEFAULT_SCALE_FACTOR = 1.1
+DEFAULT_MIN_NEIGHBORS = 4
+
+# Galleries smaller than this are searched exactly; brute force is fast enough
+ANN_MIN_GALLERY_SIZE = 20000
+# Cells of the IVF index scored per query; raise for recall, lower for speed
+DEFAULT_NPROBE = 16
+# Persist an index after this many records were added to it in memory
+ANN_SAVE_EVERY = 1000
+# Queries scored per matrix product in batch searches; bounds the score
+# matrix to this many rows of the gallery size
+SEARCH_QUERY_BLOCK = 64
+# Most matches a match run saves in one transaction and yields at once
+MATCH_SAVE_BATCH = 10000
 
 class FaceRecognitionSystem:
-    def __init__(self):
+    def __init__(self, db_path="police_records.db", block_size=DEFAULT_BLOCK_SIZE,
+                 ann_min_size=ANN_MIN_GALLERY_SIZE, nprobe=DEFAULT_NPROBE, match_threshold=0.7,
+                 quantization='float32', embedding_store=False, detection_max_side=None,
+                 scale_factor=DEFAULT_SCALE_FACTOR, min_neighbors=DEFAULT_MIN_NEIGHBORS, min_size=None,
+                 feature_cache_size=DEFAULT_MAX_ENTRIES, candidate_filter=None, match_workers=1,
+                 match_shard_size=DEFAULT_SHARD_SIZE, reduced_decode=False):
         self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        self.db = PoliceDatabase()
+        # Detection settings. detection_max_side enables fast mode: the cascade
+        # runs on a copy downscaled so its longer side is at most this many
+        # pixels, and boxes are mapped back to full-resolution crops.
+        # min_size is (w, h) in full-resolution pixels.
+        self.detection_max_side = detection_max_side
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.min_size = min_size
+        # With detection_max_side, decode large JPEGs at 1/2, 1/4 or 1/8 size
+        # (longer side still >= detection_max_side); crops come from that image
+        self.reduced_decode = reduced_decode
+        # db_path=None gives a detection/extraction-only instance (e.g. for worker processes).
+        # quantization ('float32', 'float16' or 'int8') sets the precision of
+        # stored encodings and of the in-memory galleries searched against;
+        # embedding_store=True memory-maps the galleries from files shared by
+        # every process using the same database.
+        self.db = (PoliceDatabase(db_path, quantization, embedding_store)
+                   if db_path is not None else None)
+        # Rows/columns per similarity tile when matching whole galleries
+        self.block_size = block_size
+        # Approximate search settings; ann_min_size=None always searches exactly
+        self.ann_min_size = ann_min_size
+        self.nprobe = nprobe
+        # New records are matched against the opposite gallery on insert;
+        # None leaves matching to find_matches
+        self.match_threshold = match_threshold
+        # Optional CandidateFilter; pairs it rules out on metadata (gender,
+        # age, dates, region) are never scored by find_matches/match_new_record
+        self.candidate_filter = candidate_filter
+        # Worker processes for find_matches/iter_matches (None: one per CPU);
+        # each scores shards of match_shard_size bodies from shared memory
+        self.match_workers = match_workers
+        self.match_shard_size = match_shard_size
+        self._parallel_matcher = None
+        self._ann_indexes = {}
+        self._ann_lock = threading.Lock()
+        # Encodings of recently seen photos, keyed by content; 0 disables
+        self.feature_cache = None
+        if self.db is not None and feature_cache_size:
+            self.feature_cache = FeatureCache(feature_cache_path(db_path), feature_cache_size)
+        # Optional eigenface projection, reloaded whenever the database
+        # switches to another version
+        self._projection = None
+        
+    def detect_faces(self, image):
+        """Detect faces in a photo given as a path, bytes or a binary file-like object
         
-    def detect_faces(self, image_path):
-        """Detect faces in an image"""
-        image = cv2.imread(image_path)
+        Boxes are in the photo's full-resolution coordinates; with
+        reduced_decode the crops come from the reduced-size decode.
+        """
+        try:
+            image, factor = self.decode_photo(self.read_photo(image))
+        except OSError:
+            return [], []
         if image is None:
-            return []
+            return [], []
+        faces, boxes = self.detect_faces_in_image(image)
+        if factor != 1 and len(boxes):
+            boxes = np.asarray(boxes) * factor
+        return faces, boxes
+    
+    def read_photo(self, image):
+        """Bytes of a photo given as a path, bytes or a binary file-like object"""
+        with timed('image_read'):
+            return read_image_data(image)
+    
+    def decode_photo(self, data):
+        """Decode photo bytes, at reduced size if enabled
         
+        Returns (BGR array or None if undecodable, reduction factor).
+        """
+        min_side = self.detection_max_side if self.reduced_decode else None
+        with timed('image_decode'):
+            return decode_image(data, min_side)
+    
+    @instrumented('detect_faces')
+    def detect_faces_in_image(self, image):
+        """Detect faces in a BGR image array; returns (face crops, boxes)"""
         gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        faces = self.face_cascade.detectMultiScale(gray, 1.1, 4)
+        height, width = gray.shape
+        scale = 1.0
+        if self.detection_max_side and max(height, width) > self.detection_max_side:
+            scale = self.detection_max_side / max(height, width)
+            gray = cv2.resize(gray, (max(1, round(width * scale)), max(1, round(height * scale))),
+                              interpolation=cv2.INTER_AREA)
+        
+        min_size = None
+        if self.min_size is not None:
+            min_size = tuple(max(1, round(side * scale)) for side in self.min_size)
+        faces = self.face_cascade.detectMultiScale(gray, scaleFactor=self.scale_factor,
+                                                   minNeighbors=self.min_neighbors,
+                                                   minSize=min_size)
+        
+        if scale != 1.0 and len(faces):
+            # Map boxes back onto the full-resolution image
+            faces = np.rint(np.asarray(faces) / scale).astype(np.int32)
+            faces[:, 2] = np.minimum(faces[:, 2], width - faces[:, 0])
+            faces[:, 3] = np.minimum(faces[:, 3], height - faces[:, 1])
         
         face_images = []
         for (x, y, w, h) in faces:
@@ -27,13 +153,14 @@ class FaceRecognitionSystem:
         
         return face_images, faces
     
+    @instrumented('extract_features')
     def extract_face_features(self, face_image):
         """Extract facial features using OpenCV"""
         if face_image is None or face_image.size == 0:
             return None
         
         # Resize face to standard size
-        face_resized = cv2.resize(face_image, (100, 100))
+        face_resized = cv2.resize(face_image, FACE_SIZE)
         
         # Convert to grayscale and normalize
         gray_face = cv2.cvtColor(face_resized, cv2.COLOR_BGR2GRAY)
@@ -53,17 +180,141 @@ class FaceRecognitionSystem:
         similarity = cosine_similarity([encoding1], [encoding2])[0][0]
         return similarity
     
-    def process_missing_person_photo(self, image_path, person_data):
-        """Process and store missing person photo"""
-        faces, face_coords = self.detect_faces(image_path)
+    def get_projection(self):
+        """Return the active PCA projection, or None to use raw encodings
         
-        if not faces:
-            print(f"No faces detected in {image_path}")
+        The model loaded is always the version the database says its stored
+        embeddings are in, so a refit never pairs them with another model.
+        """
+        if self.db is None:
             return None
         
-        # Use the largest face detected
-        largest_face = max(faces, key=lambda x: x.shape[0] * x.shape[1])
-        face_encoding = self.extract_face_features(largest_face)
+        version = self.db.get_projection_version()
+        while version and (self._projection is None or self._projection.version != version):
+            try:
+                self._projection = load_projection(self.db.db_path, version)
+            except FileNotFoundError:
+                # A refit committed and removed this model since the version was read
+                latest = self.db.get_projection_version()
+                if latest == version:
+                    raise
+                version = latest
+        return self._projection if version else None
+    
+    def project_encoding(self, raw_encoding):
+        """Map a raw encoding into the space the galleries are stored in"""
+        projection = self.get_projection()
+        if projection is None or raw_encoding is None:
+            return raw_encoding
+        return projection.transform(raw_encoding)
+    
+    def storage_encodings(self, raw_encoding):
+        """Database insert arguments for a raw encoding under the active projection"""
+        projection = self.get_projection()
+        if projection is None:
+            return {'face_encoding': raw_encoding}
+        return {
+            'face_encoding': projection.transform(raw_encoding),
+            'raw_encoding': raw_encoding,
+            'projection_version': projection.version
+        }
+    
+    def fit_projection(self, n_components=DEFAULT_COMPONENTS, max_samples=MAX_FIT_SAMPLES, seed=0):
+        """Fit eigenfaces on the stored raw encodings and re-project the database"""
+        rng = np.random.default_rng(seed)
+        sample = []
+        
+        # Reservoir-sample so the whole raw gallery never sits in memory
+        for seen, raw_encoding in enumerate(self.db.iter_raw_encodings(RAW_ENCODING_DIM)):
+            if len(sample) < max_samples:
+                sample.append(raw_encoding)
+            else:
+                slot = rng.integers(0, seen + 1)
+                if slot < max_samples:
+                    sample[slot] = raw_encoding
+        
+        if not sample:
+            raise ValueError("No raw encodings stored to fit a projection on")
+        
+        previous_version = self.db.get_projection_version()
+        projection = PCAProjection.fit(np.vstack(sample), n_components=n_components,
+                                       version=previous_version + 1,
+                                       max_samples=max_samples, seed=seed)
+        # Save the model before committing the embeddings it produced, so a
+        # reader that sees the new version can always load it
+        projection.save(projection_path(self.db.db_path, projection.version))
+        reprojected = self.db.reproject_encodings(projection)
+        
+        # Processes holding the old model switch as soon as they read the new version
+        for path in (projection_path(self.db.db_path, previous_version),
+                     legacy_projection_path(self.db.db_path)):
+            if os.path.exists(path):
+                os.remove(path)
+        
+        # Indexes trained in the old space are useless now
+        with self._ann_lock:
+            self._ann_indexes = {}
+        for table in ('missing_persons', 'unidentified_bodies'):
+            path = index_path(self.db.db_path, table)
+            if os.path.exists(path):
+                os.remove(path)
+        
+        return projection, reprojected
+    
+    @property
+    def extractor_key(self):
+        """Everything that changes the encoding extracted from a given photo"""
+        key = (f"v{EXTRACTOR_VERSION}-{FACE_SIZE[0]}x{FACE_SIZE[1]}-{self.detection_max_side}-"
+               f"{self.scale_factor}-{self.min_neighbors}-{self.min_size}")
+        if self.reduced_decode and self.detection_max_side:
+            key += "-reduced"
+        return key
+    
+    def encode_photo(self, image):
+        """Return the encoding of the largest face in a photo, or None
+        
+        image is a path, bytes or a binary file-like object (e.g. an upload),
+        decoded in memory. Results are cached by photo content, so repeat
+        uploads of the same image skip decoding, detection and extraction.
+        """
+        try:
+            data = self.read_photo(image)
+        except OSError:
+            print(f"Could not read {describe_source(image)}")
+            return None
+        
+        cache_key = None
+        if self.feature_cache is not None:
+            cache_key = FeatureCache.key(data, self.extractor_key)
+            hit, face_encoding = self.feature_cache.get(cache_key)
+            record_cache('feature', hit)
+            if hit:
+                return face_encoding
+        
+        decoded, _ = self.decode_photo(data)
+        faces = self.detect_faces_in_image(decoded)[0] if decoded is not None else []
+        
+        if not faces:
+            print(f"No faces detected in {describe_source(image)}")
+            face_encoding = None
+        else:
+            # Use the largest face detected
+            largest_face = max(faces, key=lambda x: x.shape[0] * x.shape[1])
+            face_encoding = self.extract_face_features(largest_face)
+        
+        if cache_key is not None:
+            self.feature_cache.put(cache_key, face_encoding)
+        return face_encoding
+    
+    def process_missing_person_photo(self, image, person_data, photo_path=None):
+        """Process and store missing person photo
+        
+        image is a path, bytes or a binary file-like object; photo_path is
+        recorded as where the photo is kept (defaults to image if it is a path).
+        """
+        face_encoding = self.encode_photo(image)
+        if face_encoding is None:
+            return None
         
         # Store in database
         person_id = self.db.add_missing_person(
@@ -74,24 +325,25 @@ class FaceRecognitionSystem:
             last_seen_location=person_data['last_seen_location'],
             description=person_data['description'],
             case_number=person_data['case_number'],
-            face_encoding=face_encoding,
-            photo_path=image_path
+            photo_path=_photo_path(image, photo_path),
+            **self.storage_encodings(face_encoding)
         )
         
+        self._update_ann_index('missing_persons')
+        if self.match_threshold is not None:
+            self.match_new_record('missing_persons', person_id)
         return person_id
     
-    def process_unidentified_body_photo(self, image_path, body_data):
-        """Process and store unidentified body photo"""
-        faces, face_coords = self.detect_faces(image_path)
+    def process_unidentified_body_photo(self, image, body_data, photo_path=None):
+        """Process and store unidentified body photo
         
-        if not faces:
-            print(f"No faces detected in {image_path}")
+        image is a path, bytes or a binary file-like object; photo_path is
+        recorded as where the photo is kept (defaults to image if it is a path).
+        """
+        face_encoding = self.encode_photo(image)
+        if face_encoding is None:
             return None
         
-        # Use the largest face detected
-        largest_face = max(faces, key=lambda x: x.shape[0] * x.shape[1])
-        face_encoding = self.extract_face_features(largest_face)
-        
         # Store in database
         body_id = self.db.add_unidentified_body(
             case_number=body_data['case_number'],
@@ -100,105 +352,378 @@ class FaceRecognitionSystem:
             estimated_age=body_data['estimated_age'],
             gender=body_data['gender'],
             description=body_data['description'],
-            face_encoding=face_encoding,
-            photo_path=image_path
+            photo_path=_photo_path(image, photo_path),
+            **self.storage_encodings(face_encoding)
         )
         
+        self._update_ann_index('unidentified_bodies')
+        if self.match_threshold is not None:
+            self.match_new_record('unidentified_bodies', body_id)
         return body_id
     
-    def find_matches(self, threshold=0.7):
-        """Find potential matches between missing persons and unidentified bodies"""
-        missing_persons = self.db.get_all_missing_persons()
-        unidentified_bodies = self.db.get_all_unidentified_bodies()
+    @instrumented('find_matches')
+    def find_matches(self, threshold=0.7, incremental=False):
+        """Find potential matches between missing persons and unidentified bodies
         
-        matches = []
+        With incremental=True only records added since the previous run are
+        scored: new persons against every body, older persons against new bodies.
+        """
+        return [match for block in self.iter_matches(threshold, incremental) for match in block]
+    
+    def iter_matches(self, threshold=0.7, incremental=False):
+        """Generator form of find_matches yielding each block's saved matches
+        
+        Blocks of up to block_size persons are scored, saved and yielded one at
+        a time (possibly as empty lists; blocks with more than MATCH_SAVE_BATCH
+        matches in several lists), so memory stays flat however many
+        matches a run finds and callers can stream them. The watermarks only
+        advance once the generator is exhausted; an abandoned run is simply
+        redone by the next incremental one.
+        """
+        gallery = get_gallery_cache(self.db)
+        persons = gallery.missing_persons
+        bodies = gallery.unidentified_bodies
+        # Rows of the matrices taken here are mapped back through these same
+        # records and ids for the whole run, whatever changes in the meantime
+        person_matrix, body_matrix = persons.matrix, bodies.matrix
+        person_records, body_records = persons.records, bodies.records
+        person_ids = persons.ids[:person_matrix.shape[0]]
+        body_ids = bodies.ids[:body_matrix.shape[0]]
+        
+        if incremental:
+            person_watermark, body_watermark = self.db.get_match_watermarks()
+        else:
+            person_watermark, body_watermark = 0, 0
         
-        for person in missing_persons:
-            person_encoding = json.loads(person[8]) if person[8] else None
-            if person_encoding is None:
+        new_persons = np.flatnonzero(person_ids > person_watermark)
+        old_persons = np.flatnonzero(person_ids <= person_watermark)
+        new_bodies = np.flatnonzero(body_ids > body_watermark)
+        all_bodies = np.arange(body_ids.shape[0])
+        
+        # Score the pairs as tiled matrix products over normalized encodings
+        for person_subset, body_subset in ((new_persons, all_bodies), (old_persons, new_bodies)):
+            if not len(person_subset) or not len(body_subset):
                 continue
             
-            person_encoding = np.array(person_encoding)
-            
-            for body in unidentified_bodies:
-                body_encoding = json.loads(body[7]) if body[7] else None
-                if body_encoding is None:
-                    continue
-                
-                body_encoding = np.array(body_encoding)
-                
-                similarity = self.compare_faces(person_encoding, body_encoding)
-                
-                if similarity >= threshold:
-                    match_id = self.db.add_match(
-                        missing_person_id=person[0],
-                        unidentified_body_id=body[0],
-                        confidence_score=similarity,
-                        notes=f"Automated match with {similarity:.2f} confidence"
-                    )
-                    
-                    matches.append({
-                        'match_id': match_id,
-                        'missing_person': person[1],  # name
-                        'missing_case': person[7],    # case_number
-                        'body_case': body[1],         # case_number
-                        'confidence': similarity,
-                        'found_location': body[3]     # found_location
-                    })
+            blocks = self._iter_pairs(persons, person_matrix, person_subset,
+                                      bodies, body_matrix, body_subset, threshold, parallel=True)
+            while True:
+                with timed('match_similarity'):
+                    block = next(blocks, None)
+                if block is None:
+                    break
+                # Dense blocks (low thresholds) are saved and yielded in chunks
+                person_rows, body_rows, scores = block
+                for start in range(0, max(len(scores), 1), MATCH_SAVE_BATCH):
+                    end = start + MATCH_SAVE_BATCH
+                    yield self._save_matches(person_records, body_records, person_rows[start:end],
+                                             body_rows[start:end], scores[start:end])
+        
+        if person_ids.shape[0] or body_ids.shape[0]:
+            self.db.set_match_watermarks(
+                int(person_ids.max()) if person_ids.shape[0] else person_watermark,
+                int(body_ids.max()) if body_ids.shape[0] else body_watermark
+            )
+    
+    @instrumented('match_new_record')
+    def match_new_record(self, table, record_id, threshold=None):
+        """Score one stored record against the opposite gallery and save its matches"""
+        threshold = self.match_threshold if threshold is None else threshold
+        gallery = get_gallery_cache(self.db)
+        persons = gallery.missing_persons
+        bodies = gallery.unidentified_bodies
+        
+        own = gallery.gallery(table)
+        row = own.row_of(record_id)
+        if row is None:
+            return []
+        
+        person_matrix, body_matrix = persons.matrix, bodies.matrix
+        if table == 'missing_persons':
+            person_subset, body_subset = np.array([row]), np.arange(body_matrix.shape[0])
+        else:
+            person_subset, body_subset = np.arange(person_matrix.shape[0]), np.array([row])
+        if not len(person_subset) or not len(body_subset):
+            return []
+        
+        person_rows, body_rows, scores = self._score_pairs(
+            persons, person_matrix, person_subset, bodies, body_matrix, body_subset, threshold)
+        return self._save_matches(persons.records, bodies.records, person_rows, body_rows, scores)
+    
+    def _score_pairs(self, persons, person_matrix, person_subset, bodies, body_matrix, body_subset, threshold):
+        """Score person_subset x body_subset; returns gallery rows and scores of pairs >= threshold"""
+        blocks = list(self._iter_pairs(persons, person_matrix, person_subset,
+                                       bodies, body_matrix, body_subset, threshold))
+        if not blocks:
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.float32)
+        return tuple(np.concatenate(values) for values in zip(*blocks))
+    
+    def _iter_pairs(self, persons, person_matrix, person_subset, bodies, body_matrix, body_subset, threshold,
+                    parallel=False):
+        """Yield (person rows, body rows, scores) of pairs >= threshold, one block of persons at a time
+        
+        parallel=True uses the worker processes when match_workers allows.
+        """
+        if parallel and self.match_workers != 1:
+            yield from self._iter_pairs_parallel(persons, person_matrix, person_subset,
+                                                 bodies, body_matrix, body_subset, threshold)
+            return
+        
+        if self.candidate_filter is None:
+            blocks = iter_similar_pairs(
+                _take_rows(person_matrix, person_subset),
+                _take_rows(body_matrix, body_subset),
+                threshold,
+                block_size=self.block_size
+            )
+            for person_rows, body_rows, scores in blocks:
+                yield person_subset[person_rows], body_subset[body_rows], scores
+            return
+        
+        candidate_filter = self.candidate_filter
+        person_attributes = candidate_filter.person_attributes(persons)
+        body_attributes = candidate_filter.body_attributes(bodies)
+        blocks = candidate_filter.blocks(person_attributes, person_subset, body_attributes, body_subset,
+                                         self.block_size)
+        yield from iter_candidate_pairs(
+            person_matrix, body_matrix, threshold, blocks,
+            keep=lambda person_rows, body_rows: candidate_filter.compatible_rows(
+                person_attributes, person_rows, body_attributes, body_rows),
+            block_size=self.block_size
+        )
+    
+    def _iter_pairs_parallel(self, persons, person_matrix, person_subset, bodies, body_matrix, body_subset,
+                             threshold):
+        keep = None
+        if self.candidate_filter is None:
+            blocks = ((person_subset[start:start + self.block_size], body_subset)
+                      for start in range(0, person_subset.shape[0], self.block_size))
+        else:
+            candidate_filter = self.candidate_filter
+            person_attributes = candidate_filter.person_attributes(persons)
+            body_attributes = candidate_filter.body_attributes(bodies)
+            blocks = candidate_filter.blocks(person_attributes, person_subset, body_attributes, body_subset,
+                                             self.block_size)
+            keep = lambda person_rows, body_rows: candidate_filter.compatible_rows(
+                person_attributes, person_rows, body_attributes, body_rows)
+        
+        if self._parallel_matcher is None:
+            self._parallel_matcher = ParallelMatcher(self.match_workers, self.match_shard_size)
+        yield from self._parallel_matcher.iter_pairs(person_matrix, body_matrix, blocks, threshold,
+                                                     self.block_size, keep)
+    
+    def _save_matches(self, person_records, body_records, person_rows, body_rows, scores):
+        """Upsert scored pairs into the matches table and describe them
+        
+        Rows index the records lists of the galleries the pairs were scored on.
+        """
+        pairs = [(person_records[person_row], body_records[body_row], float(similarity))
+                 for person_row, body_row, similarity in zip(person_rows, body_rows, scores)]
+        
+        # One transaction for the whole run instead of a commit per match
+        match_ids = self.db.add_matches(
+            (person['id'], body['id'], similarity,
+             f"Automated match with {similarity:.2f} confidence")
+            for person, body, similarity in pairs
+        )
+        
+        matches = []
+        
+        for match_id, (person, body, similarity) in zip(match_ids, pairs):
+            matches.append({
+                'match_id': match_id,
+                'missing_person': person['name'],
+                'missing_case': person['case_number'],
+                'body_case': body['case_number'],
+                'confidence': similarity,
+                'found_location': body['found_location']
+            })
         
         return matches
     
-    def search_by_photo(self, query_image_path, threshold=0.6):
-        """Search for matches using a query photo"""
+    def search_by_photo(self, query_image, threshold=0.6, k=10):
+        """Search both galleries for the k closest faces to a query photo (path, bytes or file-like)"""
         try:
-            # Generate a random encoding for demo purposes since we have sample data
-            query_encoding = np.random.rand(10000).astype(np.float32)
-            
-            # Search in missing persons
-            missing_persons = self.db.get_all_missing_persons()
-            matches = []
-            
-            for person in missing_persons:
-                person_encoding = json.loads(person[8]) if person[8] else None
-                if person_encoding is None:
-                    continue
-                
-                person_encoding = np.array(person_encoding)
-                # Generate random similarity for demo
-                similarity = np.random.uniform(0.5, 0.9)
-                
-                if similarity >= threshold:
-                    matches.append({
-                        'type': 'missing_person',
-                        'name': person[1],
-                        'case_number': person[7],
-                        'confidence': similarity,
-                        'photo_path': person[9]
-                    })
-            
-            # Search in unidentified bodies
-            unidentified_bodies = self.db.get_all_unidentified_bodies()
-            
-            for body in unidentified_bodies:
-                body_encoding = json.loads(body[7]) if body[7] else None
-                if body_encoding is None:
-                    continue
-                
-                body_encoding = np.array(body_encoding)
-                # Generate random similarity for demo
-                similarity = np.random.uniform(0.5, 0.9)
-                
-                if similarity >= threshold:
-                    matches.append({
-                        'type': 'unidentified_body',
-                        'case_number': body[1],
-                        'found_location': body[3],
-                        'confidence': similarity,
-                        'photo_path': body[8]
-                    })
-            
-            return sorted(matches, key=lambda x: x['confidence'], reverse=True)[:3]  # Limit to top 3
+            query_encoding = self.encode_photo(query_image)
+            if query_encoding is None:
+                return []
+            return self.search_by_encoding(query_encoding, threshold, k)
             
         except Exception as e:
             print(f"Search error: {e}")
-            return []
\ No newline at end of file
+            return []
+    
+    @instrumented('search_batch')
+    def search_batch(self, query_images, threshold=0.6, k=10, workers=None):
+        """Search both galleries for each of several query photos at once
+        
+        Photos (paths, bytes or file-like objects) are encoded in parallel threads and all found faces are scored
+        together; returns one result list per photo, in order, with None for
+        photos where no face was detected.
+        """
+        encodings = self.encode_photos(query_images, workers)
+        found = [row for row, encoding in enumerate(encodings) if encoding is not None]
+        results = [None] * len(encodings)
+        for row, matches in zip(found, self.search_by_encodings([encodings[row] for row in found],
+                                                               threshold, k)):
+            results[row] = matches
+        return results
+    
+    def encode_photos(self, images, workers=None):
+        """encode_photo for several photos using a pool of threads
+        
+        Decoding, detection and extraction release the GIL, so threads
+        overlap well and share this instance's caches.
+        """
+        images = list(images)
+        if len(images) <= 1 or workers == 1:
+            return [self.encode_photo(image) for image in images]
+        
+        workers = workers or min(len(images), os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(self.encode_photo, images))
+    
+    @instrumented('search')
+    def search_by_encoding(self, query_encoding, threshold=0.6, k=10):
+        """Search both galleries for the k closest faces to a raw face encoding"""
+        return self.search_by_encodings([query_encoding], threshold, k)[0]
+    
+    def search_by_encodings(self, query_encodings, threshold=0.6, k=10,
+                            tables=('missing_persons', 'unidentified_bodies')):
+        """search_by_encoding for several raw encodings; returns one result list per query
+        
+        Exact searches score every query against a gallery in one matrix product.
+        tables limits the search to some of the galleries.
+        """
+        if not len(query_encodings):
+            return []
+        queries = normalize_rows(np.vstack([np.asarray(self.project_encoding(encoding)).reshape(1, -1)
+                                            for encoding in query_encodings]))
+        gallery = get_gallery_cache(self.db)
+        results = [[] for _ in range(queries.shape[0])]
+        
+        # Search in missing persons
+        persons = gallery.missing_persons
+        hits = []
+        if 'missing_persons' in tables:
+            hits = self._search_gallery('missing_persons', persons, queries, k, threshold)
+        for matches, (rows, scores) in zip(results, hits):
+            for row, similarity in zip(rows, scores):
+                person = persons.records[row]
+                matches.append({
+                    'type': 'missing_person',
+                    'name': person['name'],
+                    'case_number': person['case_number'],
+                    'confidence': float(similarity),
+                    'photo_path': person['photo_path']
+                })
+        
+        # Search in unidentified bodies
+        bodies = gallery.unidentified_bodies
+        hits = []
+        if 'unidentified_bodies' in tables:
+            hits = self._search_gallery('unidentified_bodies', bodies, queries, k, threshold)
+        for matches, (rows, scores) in zip(results, hits):
+            for row, similarity in zip(rows, scores):
+                body = bodies.records[row]
+                matches.append({
+                    'type': 'unidentified_body',
+                    'case_number': body['case_number'],
+                    'found_location': body['found_location'],
+                    'confidence': float(similarity),
+                    'photo_path': body['photo_path']
+                })
+        
+        return [sorted(matches, key=lambda x: x['confidence'], reverse=True)[:k] for matches in results]
+    
+    def _search_gallery(self, table, gallery, queries, k, threshold):
+        """Return [(rows, scores)] of the best k matches for each normalized query row"""
+        # Take the matrix first: ids and records are never shorter than it
+        matrix = gallery.matrix
+        if matrix.shape[0] == 0:
+            return [([], [])] * queries.shape[0]
+        
+        index = self.get_ann_index(table, gallery)
+        increment('frs_searches_total', queries.shape[0], table=table,
+                  method='exact' if index is None else 'ann')
+        hits = []
+        if index is None:
+            # Bound the (queries, gallery) score matrix held at once
+            for start in range(0, queries.shape[0], SEARCH_QUERY_BLOCK):
+                with timed('search_similarity'):
+                    scores = similarity_matrix(queries[start:start + SEARCH_QUERY_BLOCK], matrix)
+                    for query_scores in scores:
+                        rows = top_k(query_scores, k, threshold)
+                        hits.append((rows, query_scores[rows]))
+            return hits
+        
+        # Only score records in the cells nearest to each query
+        ids = gallery.ids[:matrix.shape[0]]
+        for query in queries:
+            candidate_ids = index.candidate_ids(query, self.nprobe)
+            rows = np.searchsorted(ids, candidate_ids)
+            found = rows < ids.shape[0]
+            rows, candidate_ids = rows[found], candidate_ids[found]
+            rows = rows[ids[rows] == candidate_ids]
+            
+            with timed('search_similarity'):
+                scores = matrix[rows] @ query
+                best = top_k(scores, k, threshold)
+            hits.append((rows[best], scores[best]))
+        return hits
+    
+    def get_ann_index(self, table, gallery):
+        """Return the IVF index for a gallery, or None if it should be searched exactly"""
+        if self.ann_min_size is None or len(gallery) < self.ann_min_size:
+            return None
+        
+        path = index_path(self.db.db_path, table)
+        dim = gallery.matrix.shape[1]
+        projection = self.get_projection()
+        space = projection.version if projection else 0
+        
+        with self._ann_lock:
+            index = self._ann_indexes.get(table)
+            if index is None or index.dim != dim or index.space != space:
+                index = IVFIndex.load(path) if os.path.exists(path) else None
+                if index is None or index.dim != dim or index.space != space:
+                    index = IVFIndex.train(gallery.matrix, gallery.ids, space=space)
+                    index.save(path)
+                self._ann_indexes[table] = index
+        
+        index.sync(gallery)
+        if index.pending >= ANN_SAVE_EVERY:
+            index.save(path)
+        return index
+    
+    def build_ann_index(self, table, nlist=None):
+        """Retrain and persist the IVF index for one gallery from scratch"""
+        gallery = get_gallery_cache(self.db).gallery(table)
+        projection = self.get_projection()
+        
+        index = IVFIndex.train(gallery.matrix, gallery.ids, nlist=nlist,
+                               space=projection.version if projection else 0)
+        index.save(index_path(self.db.db_path, table))
+        with self._ann_lock:
+            self._ann_indexes[table] = index
+        return index
+    
+    def _update_ann_index(self, table):
+        # Fold a freshly inserted record into a loaded index right away
+        index = self._ann_indexes.get(table)
+        if index is None:
+            return
+        
+        gallery = get_gallery_cache(self.db).gallery(table)
+        self.get_ann_index(table, gallery)
+
+def _photo_path(image, photo_path):
+    if photo_path is not None:
+        return photo_path
+    return os.fspath(image) if isinstance(image, (str, os.PathLike)) else ''
+
+def _take_rows(matrix, rows):
+    # Avoid copying the whole matrix when every row is selected
+    if rows.shape[0] == matrix.shape[0]:
+        return matrix
+    return matrix[rows]
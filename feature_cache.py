@@ -0,0 +1,90 @@
+import hashlib
+import os
+import time
+from database import decode_face_encoding, encode_face_encoding, get_connection_pool
+
+# Cached photos kept before the least recently used are evicted; a raw
+# 100x100 encoding is 40 KB, so the default bounds the file near 200 MB
+DEFAULT_MAX_ENTRIES = 5000
+# A hit refreshes an entry's last_used only if it is older than this many
+# seconds, so repeat hits on hot photos are plain reads
+TOUCH_INTERVAL = 60
+
+class FeatureCache:
+    """Size-bounded LRU cache of photo encodings keyed by image content
+
+    Keys are the SHA-256 of the photo bytes plus an extractor key describing
+    everything that affects the result (extraction code version, face size,
+    detection settings), so re-uploads of the same photo skip decoding,
+    detection and extraction, and changing any setting never serves a stale
+    encoding. Photos without a detectable face are cached too.
+
+    Entries live in their own SQLite file, so cache traffic never contends
+    with the records database for its write lock.
+    """
+
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.pool = get_connection_pool(path)
+
+        with self.pool.init_lock:
+            if not self.pool.initialized:
+                with self.pool.connection(write=True) as conn:
+                    conn.execute('''
+                        CREATE TABLE IF NOT EXISTS feature_cache (
+                            key TEXT PRIMARY KEY,
+                            encoding BLOB,
+                            encoding_dtype TEXT,
+                            encoding_dim INTEGER,
+                            last_used REAL NOT NULL
+                        )
+                    ''')
+                    conn.execute('CREATE INDEX IF NOT EXISTS idx_feature_cache_last_used '
+                                 'ON feature_cache(last_used)')
+                self.pool.initialized = True
+
+    @staticmethod
+    def key(data, extractor_key):
+        """Cache key for photo bytes under one extractor configuration"""
+        return f"{hashlib.sha256(data).hexdigest()}:{extractor_key}"
+
+    def get(self, key):
+        """Return (hit, encoding); a hit with encoding None means no face was found"""
+        with self.pool.connection() as conn:
+            row = conn.execute('SELECT encoding, encoding_dtype, encoding_dim, last_used FROM feature_cache '
+                               'WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return False, None
+        
+        # LRU order only needs to be coarse; skip the write lock on most hits
+        now = time.time()
+        if now - row[3] > TOUCH_INTERVAL:
+            with self.pool.connection(write=True) as conn:
+                conn.execute('UPDATE feature_cache SET last_used = ? WHERE key = ?', (now, key))
+        return True, decode_face_encoding(*row[:3])
+
+    def put(self, key, encoding):
+        blob, dtype, dim = encode_face_encoding(encoding)
+        with self.pool.connection(write=True) as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO feature_cache (key, encoding, encoding_dtype, encoding_dim, last_used)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (key, blob, dtype, dim, time.time()))
+            conn.execute('''
+                DELETE FROM feature_cache WHERE key IN (
+                    SELECT key FROM feature_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+            ''', (self.max_entries,))
+
+    def clear(self):
+        with self.pool.connection(write=True) as conn:
+            conn.execute('DELETE FROM feature_cache')
+
+    def __len__(self):
+        with self.pool.connection() as conn:
+            return conn.execute('SELECT COUNT(*) FROM feature_cache').fetchone()[0]
+
+def feature_cache_path(db_path):
+    """Where the feature cache for db_path is kept"""
+    return f"{os.path.splitext(db_path)[0]}.features.db"
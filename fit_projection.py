@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Fit an eigenface (PCA) projection on the stored face encodings and
+re-project every record to the compact embedding
+"""
+
+import argparse
+from face_recognition_system import FaceRecognitionSystem
+from projection import DEFAULT_COMPONENTS, projection_path
+
+def fit(db_path="police_records.db", n_components=DEFAULT_COMPONENTS):
+    """Fit, persist and apply a new projection version"""
+    face_system = FaceRecognitionSystem(db_path=db_path)
+    projection, reprojected = face_system.fit_projection(n_components=n_components)
+
+    print(f"Fitted projection v{projection.version}: "
+          f"{projection.input_dim} -> {projection.output_dim} dimensions")
+    for table, count in reprojected.items():
+        print(f"{table}: re-projected {count} encodings")
+    print(f"Model saved to {projection_path(db_path, projection.version)}")
+
+if __name__ == "__main__":
+    print("Police Facial Recognition System - Eigenface Projection")
+    print("=" * 60)
+
+    parser = argparse.ArgumentParser(description="Fit a PCA projection on stored encodings")
+    parser.add_argument('--db', default='police_records.db', help='database path')
+    parser.add_argument('--components', type=int, default=DEFAULT_COMPONENTS,
+                        help='embedding dimensions to keep')
+    args = parser.parse_args()
+
+    fit(args.db, args.components)
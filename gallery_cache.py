@@ -0,0 +1,331 @@
+import os
+import threading
+import numpy as np
+from matching import normalize_rows
+from metrics import instrumented, record_cache
+from embedding_store import EmbeddingStore
+from quantization import QuantizedMatrix, int8_codes, unit_scales
+
+# Small display/filter columns kept in memory next to each encoding
+MISSING_PERSON_COLUMNS = ('id', 'name', 'age', 'gender', 'last_seen_date',
+                          'last_seen_location', 'case_number', 'photo_path', 'created_date')
+UNIDENTIFIED_BODY_COLUMNS = ('id', 'case_number', 'found_date', 'found_location',
+                             'estimated_age', 'gender', 'photo_path', 'created_date')
+
+class Gallery:
+    """Normalized encoding matrix plus metadata for the active rows of one table
+
+    quantization 'float16' or 'int8' keeps the encodings at that precision
+    (int8 with one float32 scale per row) and exposes them as a
+    QuantizedMatrix, cutting the memory held per record by 2x or 4x.
+    """
+
+    def __init__(self, quantization='float32'):
+        self.quantization = quantization
+        self.records = []
+        self._ids = np.zeros(0, dtype=np.int64)
+        self.size = 0
+        self._rows = {}
+        self._matrix = None
+        self._scales = None
+        self._changes = 0
+        self._derived = {}
+
+    @property
+    def matrix(self):
+        """(size, dim) matrix of L2-normalized encodings
+
+        A float32 ndarray, or a QuantizedMatrix for quantized galleries.
+        """
+        if self._matrix is None:
+            return np.zeros((0, 0), dtype=np.float32)
+        if self.quantization == 'float32':
+            return self._matrix[:self.size]
+        scales = self._scales[:self.size] if self._scales is not None else None
+        return QuantizedMatrix(self._matrix[:self.size], scales)
+
+    @property
+    def ids(self):
+        """Record ids of the active rows, in row order"""
+        return self._ids[:self.size]
+
+    @property
+    def nbytes(self):
+        """Memory held by the encodings of the active rows"""
+        return self.matrix.nbytes
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, record_id):
+        return record_id in self._rows
+
+    def row_of(self, record_id):
+        return self._rows.get(record_id)
+
+    def derived(self, key, compute):
+        """compute(self), memoized until the gallery next changes
+
+        For per-row arrays derived from the records (e.g. filter metadata).
+        """
+        changes = self._changes
+        cached = self._derived.get(key)
+        if cached is not None and cached[0] == changes:
+            return cached[1]
+        value = compute(self)
+        self._derived[key] = (changes, value)
+        return value
+
+    def add(self, record, encoding):
+        """Append one record; the encoding is normalized on the way in"""
+        encoding = normalize_rows(np.asarray(encoding, dtype=np.float32).reshape(1, -1))
+        scale = None
+        if self.quantization == 'int8':
+            encoding, _ = int8_codes(encoding)
+            scale = unit_scales(encoding)[0]
+        encoding = encoding[0]
+
+        if self._matrix is None:
+            self._matrix = np.zeros((16, encoding.shape[0]), dtype=self.quantization)
+            if scale is not None:
+                self._scales = np.zeros(16, dtype=np.float32)
+        elif encoding.shape[0] != self._matrix.shape[1]:
+            raise ValueError(f"Encoding has {encoding.shape[0]} values, gallery uses {self._matrix.shape[1]}")
+
+        if self.size == self._matrix.shape[0]:
+            # Grow geometrically so appends stay amortized O(dim)
+            grown = np.zeros((self.size * 2, self._matrix.shape[1]), dtype=self._matrix.dtype)
+            grown[:self.size] = self._matrix[:self.size]
+            self._matrix = grown
+            if self._scales is not None:
+                self._scales = np.resize(self._scales, self.size * 2)
+        if self.size == self._ids.shape[0]:
+            grown = np.zeros(max(16, self.size * 2), dtype=np.int64)
+            grown[:self.size] = self._ids[:self.size]
+            self._ids = grown
+
+        self._matrix[self.size] = encoding
+        if scale is not None:
+            self._scales[self.size] = scale
+        self._rows[record['id']] = self.size
+        self.records.append(record)
+        self._ids[self.size] = record['id']
+        self.size += 1
+        self._changes += 1
+
+    @classmethod
+    def mapped(cls, records, ids, matrix, quantization='float32'):
+        """Gallery over an already-built (e.g. memory-mapped) matrix
+
+        The matrix is used as is, never copied; records are aligned with its rows.
+        """
+        gallery = cls(quantization)
+        gallery.records = list(records)
+        gallery._ids = np.asarray(ids, dtype=np.int64)
+        gallery.size = len(gallery.records)
+        gallery._rows = {record['id']: row for row, record in enumerate(gallery.records)}
+        if isinstance(matrix, QuantizedMatrix):
+            gallery._matrix, gallery._scales = matrix.codes, matrix.scales
+        else:
+            gallery._matrix = matrix
+        return gallery
+
+    def append_mapped(self, record, ids, matrix):
+        """Append one record whose encoding is the last row of a remapped matrix
+
+        ids and matrix must extend the current ones by exactly that row, as a
+        store's files do after an append.
+        """
+        if isinstance(matrix, QuantizedMatrix):
+            self._matrix, self._scales = matrix.codes, matrix.scales
+        else:
+            self._matrix = matrix
+        self._rows[record['id']] = self.size
+        self.records.append(record)
+        self._ids = np.asarray(ids, dtype=np.int64)
+        self.size += 1
+        self._changes += 1
+
+    def without(self, record_id):
+        """A new gallery lacking one record, or None if it is not here
+
+        Galleries are never shrunk in place: runs and searches hold on to a
+        gallery while they map scored rows back to records, and removing a
+        row under them would shift every later one. add() only appends, which
+        leaves the rows a reader has already seen where they were.
+        """
+        row = self._rows.get(record_id)
+        if row is None:
+            return None
+
+        keep = np.ones(self._matrix.shape[0], dtype=bool)
+        keep[row] = False
+        gallery = Gallery(self.quantization)
+        gallery._matrix = self._matrix[keep]
+        if self._scales is not None:
+            gallery._scales = self._scales[keep]
+        gallery.records = self.records[:row] + self.records[row + 1:]
+        gallery._ids = np.delete(self.ids, row)
+        gallery.size = self.size - 1
+        gallery._rows = {record['id']: index for index, record in enumerate(gallery.records)}
+        return gallery
+
+class GalleryCache:
+    """Process-level cache of both galleries for one database file
+
+    The database keeps a version counter that triggers bump on every change to
+    the record tables. PoliceDatabase reports its own inserts and status changes
+    here so they are applied incrementally; any other change (another process,
+    a migration, raw SQL) is detected by the version check and causes a reload.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.quantization = db.quantization
+        self.stores = None
+        if db.embedding_store:
+            self.stores = {table: EmbeddingStore(db.db_path, table, self.quantization)
+                           for table in ('missing_persons', 'unidentified_bodies')}
+        self.version = None
+        self.missing_persons = Gallery(self.quantization)
+        self.unidentified_bodies = Gallery(self.quantization)
+        self.counts = {'missing_persons': 0, 'unidentified_bodies': 0}
+        self._lock = threading.RLock()
+
+    def refresh(self):
+        """Reload from SQLite if the database changed behind our back"""
+        version = self.db.get_gallery_version()
+        record_cache('gallery', version == self.version)
+        if version == self.version:
+            return self
+
+        with self._lock:
+            if version != self.version:
+                self._load()
+        return self
+
+    @instrumented('gallery_load')
+    def _load(self):
+        # Read the version first: a write racing the load leaves us stale and
+        # triggers another reload on the next refresh rather than being missed
+        version = self.db.get_gallery_version()
+        if self.stores is not None:
+            self._load_mapped(version)
+            return
+
+        missing_persons = Gallery(self.quantization)
+        count = 0
+        for record, encoding in self.db.get_missing_person_gallery(MISSING_PERSON_COLUMNS):
+            count += 1
+            if encoding is not None:
+                missing_persons.add(record, encoding)
+        self.counts['missing_persons'] = count
+
+        unidentified_bodies = Gallery(self.quantization)
+        count = 0
+        for record, encoding in self.db.get_unidentified_body_gallery(UNIDENTIFIED_BODY_COLUMNS):
+            count += 1
+            if encoding is not None:
+                unidentified_bodies.add(record, encoding)
+        self.counts['unidentified_bodies'] = count
+
+        self.missing_persons = missing_persons
+        self.unidentified_bodies = unidentified_bodies
+        self.version = version
+
+    def _load_mapped(self, version):
+        galleries = {}
+        for table, columns in (('missing_persons', MISSING_PERSON_COLUMNS),
+                               ('unidentified_bodies', UNIDENTIFIED_BODY_COLUMNS)):
+            store = self.stores[table]
+            self.db.sync_embedding_store(store)
+            ids, matrix = store.open()
+
+            rows = self.db.get_gallery_records(table, columns)
+            self.counts[table] = len(rows)
+            records = {record['id']: record for record, has_encoding in rows if has_encoding}
+
+            # A write between the sync and the read above can leave the two
+            # out of step; serve the rows both agree on and reload next time
+            present = np.fromiter((record_id in records for record_id in ids), dtype=bool, count=len(ids))
+            if not present.all() or len(ids) != len(records):
+                ids, matrix = ids[present], matrix[present]
+                version = None
+            galleries[table] = Gallery.mapped([records[int(record_id)] for record_id in ids],
+                                              ids, matrix, self.quantization)
+
+        self.missing_persons = galleries['missing_persons']
+        self.unidentified_bodies = galleries['unidentified_bodies']
+        self.version = version
+
+    def gallery(self, table):
+        return self.missing_persons if table == 'missing_persons' else self.unidentified_bodies
+
+    def record_insert(self, table, version, record, encoding):
+        """Apply an insert made at the given database version"""
+        with self._lock:
+            if self.version != version - 1:
+                # We missed something in between; reload lazily
+                self.version = None
+                return
+
+            self.counts[table] += 1
+            if encoding is not None:
+                if self.stores is None:
+                    self.gallery(table).add(record, encoding)
+                elif not self._append_mapped(table, record):
+                    self.version = None
+                    return
+            self.version = version
+
+    def _append_mapped(self, table, record):
+        """Extend a mapped gallery with a committed insert; False if the store disagrees
+
+        The store is synced (appending only the rows it lacks) and remapped;
+        the gallery takes its prefix up to the new record's row, so a batch
+        whose later rows are already in the store is applied a row at a time.
+        """
+        gallery = self.gallery(table)
+        store = self.stores[table]
+        self.db.sync_embedding_store(store)
+        ids, matrix = store.open()
+
+        row = gallery.size
+        if (ids.shape[0] <= row or ids[row] != record['id']
+                or (row and ids[row - 1] != gallery.ids[row - 1])):
+            return False
+        gallery.append_mapped(record, ids[:row + 1], matrix[:row + 1])
+        return True
+
+    def record_status_change(self, table, version, record_id, was_active, active):
+        """Apply a status update made at the given database version"""
+        with self._lock:
+            if self.version != version - 1 or (active and not was_active) or self.stores is not None:
+                # Re-activated records need their encoding read back, and mapped
+                # galleries are never edited in place; reload lazily
+                self.version = None
+                return
+
+            if was_active and not active:
+                gallery = self.gallery(table).without(record_id)
+                if gallery is not None:
+                    setattr(self, table, gallery)
+                self.counts[table] -= 1
+            self.version = version
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_gallery_cache(db):
+    """Return the up-to-date cache for db's file, loading it on first use"""
+    key = os.path.abspath(db.db_path)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if (cache is None or cache.quantization != db.quantization
+                or (cache.stores is not None) != db.embedding_store):
+            cache = _caches[key] = GalleryCache(db)
+    return cache.refresh()
+
+def peek_gallery_cache(db_path):
+    """Return the cache for db_path if one has been loaded, without loading it"""
+    return _caches.get(os.path.abspath(db_path))
@@ -0,0 +1,85 @@
+"""
+Reading and decoding photos from paths, bytes or file-like objects
+
+Uploads can be decoded straight from memory with cv2.imdecode instead of
+being written to disk and read back. Large JPEGs can be decoded at 1/2,
+1/4 or 1/8 scale (libjpeg's DCT scaling), which is several times faster
+than a full decode followed by a resize.
+"""
+
+import os
+import struct
+import cv2
+import numpy as np
+
+# Reduced-size decode flags by scale denominator
+REDUCED_DECODE_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4,
+                        8: cv2.IMREAD_REDUCED_COLOR_8}
+
+# JPEG start-of-frame markers (baseline, progressive, lossless, ...) carry the size
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+def read_image_data(source):
+    """Bytes of a photo given as a path, a bytes-like object or a binary file-like object"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source)
+    if hasattr(source, 'read'):
+        return source.read()
+    with open(source, 'rb') as f:
+        return f.read()
+
+def describe_source(source):
+    """Short name of a photo source for log messages"""
+    if isinstance(source, (str, os.PathLike)):
+        return os.fspath(source)
+    return getattr(source, 'filename', None) or getattr(source, 'name', None) or 'uploaded photo'
+
+def jpeg_size(data):
+    """(width, height) from a JPEG's frame header, or None if data is not a readable JPEG"""
+    if data[:2] != b'\xff\xd8':
+        return None
+    offset = 2
+    while offset + 4 <= len(data):
+        if data[offset] != 0xFF:
+            return None
+        marker = data[offset + 1]
+        if marker == 0xFF:  # fill byte
+            offset += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:  # markers without a length
+            offset += 2
+            continue
+        length = struct.unpack('>H', data[offset + 2:offset + 4])[0]
+        if marker in _SOF_MARKERS:
+            if offset + 9 > len(data):
+                return None
+            height, width = struct.unpack('>HH', data[offset + 5:offset + 9])
+            return width, height
+        offset += 2 + length
+    return None
+
+def reduction_for(data, min_side):
+    """Largest decode reduction (1, 2, 4 or 8) keeping a JPEG's longer side >= min_side"""
+    size = jpeg_size(data) if min_side else None
+    if size is None:
+        return 1
+    longer = max(size)
+    for factor in (8, 4, 2):
+        if longer // factor >= min_side:
+            return factor
+    return 1
+
+def decode_image(data, min_side=None):
+    """Decode photo bytes; returns (BGR array or None if undecodable, reduction factor)
+
+    With min_side, JPEGs are decoded at the largest reduced size whose
+    longer side is still at least min_side pixels; multiplying coordinates
+    in the decoded image by the factor maps them onto the full-size photo.
+    """
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    factor = reduction_for(data, min_side)
+    if factor > 1:
+        image = cv2.imdecode(buffer, REDUCED_DECODE_FLAGS[factor])
+        if image is not None:
+            return image, factor
+    return cv2.imdecode(buffer, cv2.IMREAD_COLOR), 1
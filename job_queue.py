@@ -0,0 +1,232 @@
+import json
+import os
+import pickle
+import threading
+import time
+from database import get_connection_pool
+
+# Seconds an idle worker sleeps before polling for jobs queued by other processes
+POLL_INTERVAL = 1.0
+# Error of jobs queued by older versions, whose data only lived in the
+# memory of the process that queued them
+DATA_LOST_ERROR = 'upload lost before processing (server restarted); please resubmit'
+
+class JobQueue:
+    """Persistent FIFO queue of background jobs stored in SQLite
+
+    Jobs have a kind, a JSON payload and move queued -> running -> done or
+    failed, with a JSON result or an error message. Claiming is a single
+    UPDATE ... RETURNING, so any number of workers, in any process, can pull
+    from the same queue without handing one job out twice.
+
+    A job can carry data too large or too binary for its payload (e.g.
+    uploaded photo bytes). It is spooled to a file next to the queue before
+    the job is committed and removed when the job finishes, so any worker,
+    in any process and after a restart, can run the job.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.spool_dir = f"{os.path.splitext(path)[0]}.spool"
+        self.pool = get_connection_pool(path)
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+        with self.pool.init_lock:
+            if not self.pool.initialized:
+                with self.pool.connection(write=True) as conn:
+                    conn.execute('''
+                        CREATE TABLE IF NOT EXISTS jobs (
+                            id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            kind TEXT NOT NULL,
+                            payload TEXT NOT NULL,
+                            status TEXT NOT NULL DEFAULT 'queued',
+                            result TEXT,
+                            error TEXT,
+                            created REAL NOT NULL,
+                            started REAL,
+                            finished REAL,
+                            owner TEXT
+                        )
+                    ''')
+                    conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id)')
+                    # Older queues lack the owner column (set on jobs whose data
+                    # was held in memory by the queuing process)
+                    columns = [row[1] for row in conn.execute('PRAGMA table_info(jobs)')]
+                    if 'owner' not in columns:
+                        conn.execute('ALTER TABLE jobs ADD COLUMN owner TEXT')
+                self.pool.initialized = True
+
+    def submit(self, kind, payload, data=None):
+        """Queue a job and return its id; data (any picklable value) is spooled to disk"""
+        with self.pool.connection(write=True) as conn:
+            cursor = conn.execute('INSERT INTO jobs (kind, payload, created) VALUES (?, ?, ?)',
+                                  (kind, json.dumps(payload), time.time()))
+            job_id = cursor.lastrowid
+            # Written before the commit, so a job is never claimed without its data
+            if data is not None:
+                with open(self._spool_path(job_id), 'wb') as f:
+                    pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            return job_id
+
+    def claim(self):
+        """Mark the oldest queued job running; returns (id, kind, payload, data) or None
+
+        data is what the job was submitted with, or None.
+        """
+        with self.pool.connection(write=True) as conn:
+            row = conn.execute('''
+                UPDATE jobs SET status = 'running', started = ?
+                WHERE id = (SELECT id FROM jobs WHERE status = 'queued' AND owner IS NULL
+                            ORDER BY id LIMIT 1)
+                RETURNING id, kind, payload
+            ''', (time.time(),)).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1], json.loads(row[2]), self._load_data(row[0])
+
+    def complete(self, job_id, result):
+        self._finish(job_id, 'done', result=json.dumps(result))
+
+    def fail(self, job_id, error):
+        self._finish(job_id, 'failed', error=error)
+
+    def _finish(self, job_id, status, result=None, error=None):
+        with self.pool.connection(write=True) as conn:
+            conn.execute('UPDATE jobs SET status = ?, result = ?, error = ?, finished = ? WHERE id = ?',
+                         (status, result, error, time.time(), job_id))
+        self._remove_data(job_id)
+
+    def _spool_path(self, job_id):
+        return os.path.join(self.spool_dir, f"{job_id}.pickle")
+
+    def _load_data(self, job_id):
+        try:
+            with open(self._spool_path(job_id), 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _remove_data(self, job_id):
+        try:
+            os.remove(self._spool_path(job_id))
+        except FileNotFoundError:
+            pass
+
+    def get(self, job_id):
+        """Return a job as a dict, or None if there is no such job"""
+        with self.pool.connection() as conn:
+            row = conn.execute('''
+                SELECT id, kind, payload, status, result, error, created, started, finished
+                FROM jobs WHERE id = ?
+            ''', (job_id,)).fetchone()
+        if row is None:
+            return None
+
+        return {
+            'id': row[0],
+            'kind': row[1],
+            'payload': json.loads(row[2]),
+            'status': row[3],
+            'result': json.loads(row[4]) if row[4] is not None else None,
+            'error': row[5],
+            'created': row[6],
+            'started': row[7],
+            'finished': row[8]
+        }
+
+    def status_counts(self):
+        """Number of jobs in each status"""
+        with self.pool.connection() as conn:
+            return dict(conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+
+    def requeue_stale(self, max_age):
+        """Put jobs running for over max_age seconds back in the queue
+
+        Recovers jobs whose worker crashed or was stopped mid-job; max_age
+        must exceed the longest real job so live ones are left alone. Their
+        spooled data is still on disk. Unfinished owned jobs, left by older
+        versions that kept job data in memory, can never run and are failed.
+        """
+        now = time.time()
+        with self.pool.connection(write=True) as conn:
+            conn.execute("""
+                UPDATE jobs SET status = 'failed', error = ?, finished = ?
+                WHERE owner IS NOT NULL AND status IN ('queued', 'running')
+            """, (DATA_LOST_ERROR, now))
+            requeued = conn.execute("""
+                UPDATE jobs SET status = 'queued', started = NULL
+                WHERE status = 'running' AND started < ?
+            """, (now - max_age,)).rowcount
+            live = {row[0] for row in conn.execute("SELECT id FROM jobs WHERE status IN ('queued', 'running')")}
+
+        # Data of jobs that finished while its file could not be removed
+        for name in os.listdir(self.spool_dir):
+            stem, extension = os.path.splitext(name)
+            if extension == '.pickle' and stem.isdigit() and int(stem) not in live:
+                self._remove_data(int(stem))
+        return requeued
+
+class JobWorkerPool:
+    """Background threads that run queued jobs with one handler per job kind
+
+    Each handler takes the job payload and the job's data (see submit; None
+    if there is none) and returns a JSON-serializable result;
+    an exception marks the job failed with its message. Detection,
+    extraction and the matrix products release the GIL, so threads overlap
+    well and share this process's galleries and caches.
+    """
+
+    def __init__(self, queue, handlers, workers=2):
+        self.queue = queue
+        self.handlers = handlers
+        self.workers = workers
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"job-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def submit(self, kind, payload, data=None):
+        """Queue a job and wake an idle worker; returns the job id
+
+        data (e.g. uploaded photo bytes) is spooled by the queue and passed
+        to the handler.
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"No handler for job kind {kind!r}")
+        job_id = self.queue.submit(kind, payload, data)
+        self._wakeup.set()
+        return job_id
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            job = self.queue.claim()
+            if job is None:
+                self._wakeup.wait(POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+
+            job_id, kind, payload, data = job
+            handler = self.handlers.get(kind)
+            try:
+                if handler is None:
+                    raise ValueError(f"No handler for job kind {kind!r}")
+                self.queue.complete(job_id, handler(payload, data))
+            except Exception as e:
+                print(f"Job {job_id} ({kind}) failed: {e}")
+                self.queue.fail(job_id, str(e))
+
+def job_queue_path(db_path):
+    """Where the job queue for db_path is kept"""
+    return f"{os.path.splitext(db_path)[0]}.jobs.db"
@@ -140,8 +140,9 @@ def search_by_photo_cli(face_system):
         return
     
     threshold = float(input("Confidence Threshold (0.0-1.0, default 0.6): ") or 0.6)
+    top_k = int(input("Maximum Results (default 10): ") or 10)
     
-    matches = face_system.search_by_photo(photo_path, threshold)
+    matches = face_system.search_by_photo(photo_path, threshold, k=top_k)
     
     if matches:
         print(f"\n🎯 Found {len(matches)} potential matches:")
@@ -159,8 +160,9 @@ def find_matches_cli(face_system):
     print("-" * 30)
     
     threshold = float(input("Confidence Threshold (0.0-1.0, default 0.7): ") or 0.7)
+    incremental = input("Only records added since last run? (y/N): ").strip().lower() == 'y'
     
-    matches = face_system.find_matches(threshold)
+    matches = face_system.find_matches(threshold, incremental=incremental)
     
     if matches:
         print(f"\n✅ Found {len(matches)} potential matches:")
@@ -177,13 +179,11 @@ def show_statistics(db):
     print("\n📊 System Statistics")
     print("-" * 30)
     
-    missing_persons = db.get_all_missing_persons()
-    unidentified_bodies = db.get_all_unidentified_bodies()
-    matches = db.get_matches(0.6)
+    stats = db.get_stats(0.6)
     
-    print(f"Missing Persons: {len(missing_persons)}")
-    print(f"Unidentified Bodies: {len(unidentified_bodies)}")
-    print(f"Potential Matches: {len(matches)}")
+    print(f"Missing Persons: {stats['missing_persons']}")
+    print(f"Unidentified Bodies: {stats['unidentified_bodies']}")
+    print(f"Potential Matches: {stats['potential_matches']}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,142 @@
+import numpy as np
+
+DEFAULT_BLOCK_SIZE = 1024
+
+def normalize_rows(matrix):
+    """L2-normalize each row so dot products become cosine similarities"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    # Zero vectors score 0 against everything, as with sklearn's cosine_similarity
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def iter_similarity_blocks(queries, gallery, block_size=DEFAULT_BLOCK_SIZE):
+    """Yield (row_offset, col_offset, scores) tiles of queries @ gallery.T
+
+    Both inputs must already be row-normalized float32 matrices or
+    QuantizedMatrix instances. Each tile is at most block_size x block_size,
+    so memory stays bounded for any gallery size.
+    """
+    if queries.shape[1] != gallery.shape[1]:
+        raise ValueError(f"Encoding dimensions differ: {queries.shape[1]} vs {gallery.shape[1]}")
+
+    for row_start in range(0, queries.shape[0], block_size):
+        query_block = queries[row_start:row_start + block_size]
+        for col_start in range(0, gallery.shape[0], block_size):
+            gallery_block = gallery[col_start:col_start + block_size]
+            yield row_start, col_start, _tile_scores(query_block, gallery_block)
+
+def similarity_matrix(queries, gallery):
+    """(len(queries), len(gallery)) scores of normalized queries against a gallery
+
+    The gallery may be a float32 matrix or a QuantizedMatrix.
+    """
+    return _tile_scores(queries, gallery)
+
+def _tile_scores(query_block, gallery_block):
+    query_block = np.asarray(query_block, dtype=np.float32)
+    if isinstance(gallery_block, np.ndarray):
+        return query_block @ gallery_block.T
+    # Quantized galleries score their own codes against the float32 queries
+    return (gallery_block @ query_block.T).T
+
+def find_similar_pairs(queries, gallery, threshold, block_size=DEFAULT_BLOCK_SIZE):
+    """Return (query_rows, gallery_cols, scores) for all pairs scoring >= threshold
+
+    Pairs are ordered by query row, then gallery column.
+    """
+    return _concatenate_pairs(iter_similar_pairs(queries, gallery, threshold, block_size))
+
+def iter_similar_pairs(queries, gallery, threshold, block_size=DEFAULT_BLOCK_SIZE):
+    """Yield find_similar_pairs' result one block of block_size query rows at a time
+
+    Blocks come in query-row order (possibly empty), each ordered by query
+    row then gallery column, so only one block's pairs are held at once.
+    """
+    rows, cols, scores = [], [], []
+    current = None
+
+    for row_start, col_start, block in iter_similarity_blocks(queries, gallery, block_size):
+        if row_start != current and current is not None:
+            yield _sorted_pairs(rows, cols, scores)
+            rows, cols, scores = [], [], []
+        current = row_start
+
+        block_rows, block_cols = np.nonzero(block >= threshold)
+        if block_rows.size == 0:
+            continue
+        rows.append(block_rows + row_start)
+        cols.append(block_cols + col_start)
+        scores.append(block[block_rows, block_cols])
+
+    if current is not None:
+        yield _sorted_pairs(rows, cols, scores)
+
+def iter_candidate_pairs(queries, gallery, threshold, blocks, keep=None, block_size=DEFAULT_BLOCK_SIZE):
+    """Like iter_similar_pairs, but score only the candidates blocks yields
+
+    blocks yields (query_rows, gallery_rows) index arrays, e.g. from
+    CandidateFilter.blocks: every query in query_rows is scored against
+    every gallery row in gallery_rows, block_size gallery rows at a time.
+    keep(query_rows, gallery_rows), if given, drops pairs from those scoring
+    >= threshold (it gets equal-length row arrays and returns a boolean
+    mask). Rows index queries and gallery directly. Yields (rows, cols,
+    scores) per block of candidates, ordered by query row then gallery row;
+    blocks follow the order blocks yields them in.
+    """
+    for query_rows, gallery_rows in blocks:
+        query_block = queries[query_rows]
+        rows, cols, scores = [], [], []
+
+        for col_start in range(0, gallery_rows.shape[0], block_size):
+            tile_rows = gallery_rows[col_start:col_start + block_size]
+            block = _tile_scores(query_block, gallery[tile_rows])
+            block_rows, block_cols = np.nonzero(block >= threshold)
+            if block_rows.size == 0:
+                continue
+            block_scores = block[block_rows, block_cols]
+            block_rows, block_cols = query_rows[block_rows], tile_rows[block_cols]
+            if keep is not None:
+                kept = keep(block_rows, block_cols)
+                block_rows, block_cols, block_scores = block_rows[kept], block_cols[kept], block_scores[kept]
+            rows.append(block_rows)
+            cols.append(block_cols)
+            scores.append(block_scores)
+
+        yield _sorted_pairs(rows, cols, scores)
+
+def _concatenate_pairs(blocks):
+    blocks = [block for block in blocks if block[0].size]
+    if not blocks:
+        return _sorted_pairs([], [], [])
+    return tuple(np.concatenate(values) for values in zip(*blocks))
+
+def _sorted_pairs(rows, cols, scores):
+    if not rows:
+        return (np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp),
+                np.zeros(0, dtype=np.float32))
+
+    rows = np.concatenate(rows)
+    cols = np.concatenate(cols)
+    scores = np.concatenate(scores)
+    order = np.lexsort((cols, rows))
+    return rows[order], cols[order], scores[order]
+
+def top_k(scores, k, threshold=None):
+    """Return indices of the k highest scores (>= threshold), best first
+
+    Uses np.argpartition so only the selected candidates are fully sorted.
+    """
+    scores = np.asarray(scores)
+    if threshold is not None:
+        candidates = np.flatnonzero(scores >= threshold)
+    else:
+        candidates = np.arange(scores.shape[0])
+
+    if k is not None and candidates.size > k:
+        if k <= 0:
+            return candidates[:0]
+        partitioned = np.argpartition(-scores[candidates], k - 1)[:k]
+        candidates = candidates[partitioned]
+
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
@@ -0,0 +1,178 @@
+"""
+In-process performance metrics rendered in the Prometheus text format
+
+Hot paths wrap their stages in `timed('stage')` or decorate them with
+`@instrumented('stage')`; caches report through `record_cache(name, hit)`.
+Collection is on unless FRS_METRICS=0 is set or disable() is called, and
+while off every hook is a flag check returning a shared no-op object.
+"""
+
+import functools
+import os
+import threading
+import time
+
+# Histogram bucket upper bounds in seconds, from sub-millisecond lookups to
+# multi-second detections on large photos
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_enabled = os.environ.get('FRS_METRICS', '1') == '1'
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_gauges = []
+
+def enable():
+    global _enabled
+    _enabled = True
+
+def disable():
+    global _enabled
+    _enabled = False
+
+def is_enabled():
+    return _enabled
+
+def reset():
+    """Forget every recorded observation (gauge callbacks stay registered)"""
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+class Histogram:
+    """Bucketed latency distribution of one stage"""
+
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        index = 0
+        while index < len(self.buckets) and seconds > self.buckets[index]:
+            index += 1
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += seconds
+
+class _Timer:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+def _histogram(stage):
+    histogram = _histograms.get(stage)
+    if histogram is None:
+        with _lock:
+            histogram = _histograms.setdefault(stage, Histogram())
+    return histogram
+
+def timed(stage):
+    """Context manager adding the time spent in its block to a stage histogram"""
+    if not _enabled:
+        return _NULL_TIMER
+    return _Timer(_histogram(stage))
+
+def instrumented(stage):
+    """Decorator timing every call of a function as one stage"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Timer(_histogram(stage)):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def increment(name, amount=1, **labels):
+    """Add to a counter; labels become Prometheus labels"""
+    if not _enabled:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+def record_cache(cache, hit):
+    """Count one lookup in a named cache"""
+    if _enabled:
+        increment('frs_cache_requests_total', cache=cache, result='hit' if hit else 'miss')
+
+def register_gauge(name, help_text, callback):
+    """Report callback() -> {labels dict as tuple of pairs: value} at render time"""
+    _gauges.append((name, help_text, callback))
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+def render():
+    """Every metric in the Prometheus text exposition format"""
+    lines = []
+    with _lock:
+        histograms = sorted(_histograms.items())
+        counters = sorted(_counters.items())
+
+    if histograms:
+        lines.append('# HELP frs_stage_seconds Time spent in each processing stage')
+        lines.append('# TYPE frs_stage_seconds histogram')
+        for stage, histogram in histograms:
+            with histogram._lock:
+                counts, total = list(histogram.counts), histogram.sum
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'frs_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'frs_stage_seconds_sum{{stage="{stage}"}} {total}')
+            lines.append(f'frs_stage_seconds_count{{stage="{stage}"}} {cumulative}')
+
+    typed = set()
+    for (name, labels), value in counters:
+        if name not in typed:
+            lines.append(f'# TYPE {name} counter')
+            typed.add(name)
+        lines.append(f'{name}{_format_labels(labels)} {value}')
+
+    # Hit ratio per cache, derived from the request counters
+    caches = {}
+    for (name, labels), value in counters:
+        if name == 'frs_cache_requests_total':
+            labels = dict(labels)
+            hits, total = caches.get(labels['cache'], (0, 0))
+            caches[labels['cache']] = (hits + (value if labels['result'] == 'hit' else 0), total + value)
+    if caches:
+        lines.append('# HELP frs_cache_hit_ratio Fraction of cache lookups that were hits')
+        lines.append('# TYPE frs_cache_hit_ratio gauge')
+        for cache, (hits, total) in sorted(caches.items()):
+            lines.append(f'frs_cache_hit_ratio{{cache="{cache}"}} {hits / total}')
+
+    for name, help_text, callback in _gauges:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} gauge')
+        for labels, value in sorted(callback().items()):
+            lines.append(f'{name}{_format_labels(labels)} {value}')
+
+    return '\n'.join(lines) + '\n'
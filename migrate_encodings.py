@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+Migrate face encodings in an existing police_records.db from JSON text
+to binary blobs, optionally re-encoding them at a lower precision
+"""
+
+import argparse
+from database import PoliceDatabase
+from quantization import QUANTIZATION_MODES
+
+def migrate(db_path="police_records.db", quantization='float32'):
+    """Convert all JSON encodings in db_path, and any stored at another precision, in place"""
+    db = PoliceDatabase(db_path, quantization)
+    converted = db.migrate_encodings()
+
+    for table, count in converted.items():
+        print(f"{table}: converted {count} encodings")
+
+    print("\nMigration complete!")
+
+if __name__ == "__main__":
+    print("Police Facial Recognition System - Encoding Migration")
+    print("=" * 60)
+
+    parser = argparse.ArgumentParser(description="Convert stored face encodings")
+    parser.add_argument('db', nargs='?', default='police_records.db', help='database path')
+    parser.add_argument('--quantization', choices=QUANTIZATION_MODES, default='float32',
+                        help='precision to store encodings at')
+    args = parser.parse_args()
+
+    migrate(args.db, args.quantization)
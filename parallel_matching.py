@@ -0,0 +1,200 @@
+"""
+Multi-process matching over galleries in shared memory
+
+ParallelMatcher copies both encoding matrices into multiprocessing
+shared_memory blocks once per run, splits each block of persons' candidate
+bodies into shards and scores the shards on a pool of worker processes,
+which attach to the shared matrices instead of receiving copies. Results
+are merged per block of persons in the serial path's order.
+
+Workers are started from a fork server (spawned on Windows) rather than
+forked from the calling process, which may hold database connections and
+threads mid-lock; they import only this module's numpy-side dependencies,
+plus the main script as every non-fork start method does.
+
+Shards are whole multiples of the serial tile size, so every score comes
+from the same matrix product as in the serial path and the results are
+identical, not just equivalent.
+"""
+
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from matching import DEFAULT_BLOCK_SIZE, find_similar_pairs
+from quantization import QuantizedMatrix
+
+# Bodies scored per task; rounded up to a multiple of the tile size
+DEFAULT_SHARD_SIZE = 8192
+
+def pool_context():
+    """Multiprocessing context the worker pool is started with"""
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        # The server preloads numpy and the matching code for every worker
+        context.set_forkserver_preload([__name__])
+        return context
+    return multiprocessing.get_context('spawn')
+
+class SharedMatrix:
+    """A float32 matrix or QuantizedMatrix copied into shared memory
+
+    spec is a small picklable description workers pass to attach() to map
+    the same memory; a worker stays attached until it is given other specs. close() releases and removes the blocks.
+    """
+
+    def __init__(self, matrix):
+        quantized = isinstance(matrix, QuantizedMatrix)
+        arrays = (matrix.codes, matrix.scales) if quantized else (matrix,)
+        self._blocks = []
+        specs = []
+        try:
+            for array in arrays:
+                if array is None:
+                    specs.append(None)
+                    continue
+                block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                self._blocks.append(block)
+                np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+                specs.append((block.name, array.shape, array.dtype.str))
+        except BaseException:
+            self.close()
+            raise
+        self.spec = (quantized, tuple(specs))
+
+    def close(self):
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+# Shared blocks this worker process has attached to, by name
+_attached = {}
+
+def attach(*specs):
+    """Map SharedMatrix instances in this process from their specs; returns the matrices"""
+    names = {array_spec[0] for _, array_specs in specs for array_spec in array_specs
+             if array_spec is not None}
+    # Detach from the matrices of earlier runs; their blocks are gone
+    for name in list(_attached):
+        if name not in names:
+            block, _ = _attached.pop(name)
+            block.close()
+
+    matrices = []
+    for quantized, array_specs in specs:
+        arrays = []
+        for array_spec in array_specs:
+            if array_spec is None:
+                arrays.append(None)
+                continue
+            name, shape, dtype = array_spec
+            if name not in _attached:
+                block = shared_memory.SharedMemory(name=name)
+                _attached[name] = (block, np.ndarray(shape, dtype=dtype, buffer=block.buf))
+            arrays.append(_attached[name][1])
+        matrices.append(QuantizedMatrix(*arrays) if quantized else arrays[0])
+    return matrices
+
+def _rows(rows):
+    """Contiguous row ranges travel as slices instead of index arrays"""
+    if rows.shape[0] and rows[-1] - rows[0] + 1 == rows.shape[0]:
+        return slice(int(rows[0]), int(rows[-1]) + 1)
+    return rows
+
+def _score_shard(person_spec, body_spec, person_rows, body_rows, threshold, block_size):
+    persons, bodies = attach(person_spec, body_spec)
+    rows, cols, scores = find_similar_pairs(persons[person_rows], bodies[body_rows], threshold, block_size)
+    if isinstance(person_rows, slice):
+        rows += person_rows.start
+    else:
+        rows = person_rows[rows]
+    if isinstance(body_rows, slice):
+        cols += body_rows.start
+    else:
+        cols = body_rows[cols]
+    return rows, cols, scores
+
+class ParallelMatcher:
+    """Scores person x body blocks on a pool of worker processes
+
+    workers defaults to the CPU count; the pool is started on first use and
+    kept until close().
+    """
+
+    def __init__(self, workers=None, shard_size=DEFAULT_SHARD_SIZE):
+        self.workers = workers or os.cpu_count() or 1
+        self.shard_size = shard_size
+        self._executor = None
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def iter_pairs(self, person_matrix, body_matrix, blocks, threshold, block_size=DEFAULT_BLOCK_SIZE,
+                   keep=None):
+        """Parallel iter_candidate_pairs: yield (person_rows, body_rows, scores) per block
+
+        blocks yields (person_rows, body_rows) as for iter_candidate_pairs,
+        and keep, if given, drops pairs from those scoring >= threshold.
+        Blocks without bodies yield nothing.
+        """
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=pool_context())
+        # Whole tiles per shard keep every product the same shape as serially
+        shard_size = max(1, -(-self.shard_size // block_size)) * block_size
+
+        persons = SharedMatrix(person_matrix)
+        try:
+            bodies = SharedMatrix(body_matrix)
+            try:
+                yield from self._run(persons.spec, bodies.spec, blocks, threshold, block_size,
+                                     shard_size, keep)
+            finally:
+                bodies.close()
+        finally:
+            persons.close()
+
+    def _run(self, person_spec, body_spec, blocks, threshold, block_size, shard_size, keep):
+        # Keep a couple of tasks per worker in flight; results are taken
+        # in submission order and merged per block
+        pending = deque()
+        shards = {}
+
+        def finish(block):
+            rows, cols, scores = (np.concatenate(values) for values in zip(*shards.pop(block)))
+            if keep is not None:
+                kept = keep(rows, cols)
+                rows, cols, scores = rows[kept], cols[kept], scores[kept]
+            order = np.lexsort((cols, rows))
+            return rows[order], cols[order], scores[order]
+
+        def collect():
+            block, last, future = pending.popleft()
+            shards.setdefault(block, []).append(future.result())
+            return finish(block) if last else None
+
+        try:
+            for block, (person_rows, body_rows) in enumerate(blocks):
+                person_rows, body_rows = np.asarray(person_rows), np.asarray(body_rows)
+                for start in range(0, body_rows.shape[0], shard_size):
+                    future = self._executor.submit(_score_shard, person_spec, body_spec, _rows(person_rows),
+                                                   _rows(body_rows[start:start + shard_size]), threshold,
+                                                   block_size)
+                    pending.append((block, start + shard_size >= body_rows.shape[0], future))
+                    while len(pending) > 2 * self.workers:
+                        result = collect()
+                        if result is not None:
+                            yield result
+
+            while pending:
+                result = collect()
+                if result is not None:
+                    yield result
+        finally:
+            # An abandoned run leaves nothing queued behind it
+            for _, _, future in pending:
+                future.cancel()
@@ -4,10 +4,10 @@ Populate sample data for Police Facial Recognition System
 """
 
 import sqlite3
-import json
 import numpy as np
 from datetime import datetime, timedelta
 import random
+from database import encode_face_encoding
 
 def generate_fake_face_encoding():
     """Generate a fake face encoding for demo purposes"""
@@ -108,33 +108,35 @@ def populate_sample_data():
     print("Adding sample missing persons...")
     for person in missing_persons:
         face_encoding = generate_fake_face_encoding()
-        encoding_str = json.dumps(face_encoding.tolist())
+        encoding_blob, encoding_dtype, encoding_dim = encode_face_encoding(face_encoding)
         
         cursor.execute('''
             INSERT INTO missing_persons 
             (name, age, gender, last_seen_date, last_seen_location, description, 
-             case_number, face_encoding, photo_path)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+             case_number, face_encoding, photo_path, encoding_dtype, encoding_dim)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (person['name'], person['age'], person['gender'], 
               person['last_seen_date'], person['last_seen_location'], 
               person['description'], person['case_number'], 
-              encoding_str, f"sample_photos/{person['case_number']}.jpg"))
+              encoding_blob, f"sample_photos/{person['case_number']}.jpg",
+              encoding_dtype, encoding_dim))
         
         print(f"Added: {person['name']} ({person['case_number']})")
     
     print("\nAdding sample unidentified bodies...")
     for body in unidentified_bodies:
         face_encoding = generate_fake_face_encoding()
-        encoding_str = json.dumps(face_encoding.tolist())
+        encoding_blob, encoding_dtype, encoding_dim = encode_face_encoding(face_encoding)
         
         cursor.execute('''
             INSERT INTO unidentified_bodies 
             (case_number, found_date, found_location, estimated_age, gender, 
-             description, face_encoding, photo_path)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+             description, face_encoding, photo_path, encoding_dtype, encoding_dim)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (body['case_number'], body['found_date'], body['found_location'],
               body['estimated_age'], body['gender'], body['description'],
-              encoding_str, f"sample_photos/{body['case_number']}.jpg"))
+              encoding_blob, f"sample_photos/{body['case_number']}.jpg",
+              encoding_dtype, encoding_dim))
         
         print(f"Added: {body['case_number']} - {body['gender']}, age {body['estimated_age']}")
     
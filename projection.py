@@ -0,0 +1,76 @@
+import os
+import numpy as np
+from sklearn.decomposition import PCA
+
+DEFAULT_COMPONENTS = 256
+# Rows used to fit the projection; eigenfaces converge long before this
+MAX_FIT_SAMPLES = 10000
+
+class PCAProjection:
+    """Eigenface projection from raw pixel encodings to a compact embedding
+
+    Each fit gets a new version number and its own model file; the database
+    records the version its stored embeddings are in, and stored rows the
+    version they were projected with, so stale embeddings can be detected.
+    """
+
+    def __init__(self, mean, components, version=1):
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.components = np.asarray(components, dtype=np.float32)
+        self.version = int(version)
+
+    @property
+    def input_dim(self):
+        return self.components.shape[1]
+
+    @property
+    def output_dim(self):
+        return self.components.shape[0]
+
+    @classmethod
+    def fit(cls, matrix, n_components=DEFAULT_COMPONENTS, version=1, max_samples=MAX_FIT_SAMPLES, seed=0):
+        """Fit on an (n, input_dim) matrix of raw encodings"""
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if matrix.shape[0] > max_samples:
+            rng = np.random.default_rng(seed)
+            matrix = matrix[np.sort(rng.choice(matrix.shape[0], max_samples, replace=False))]
+
+        n_components = min(n_components, matrix.shape[0], matrix.shape[1])
+        pca = PCA(n_components=n_components, svd_solver='randomized', random_state=seed)
+        pca.fit(matrix)
+        return cls(pca.mean_, pca.components_, version=version)
+
+    def transform(self, encodings):
+        """Project one encoding (1-D) or a batch of encodings (2-D)"""
+        encodings = np.asarray(encodings, dtype=np.float32)
+        return (encodings - self.mean) @ self.components.T
+
+    def save(self, path):
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, mean=self.mean, components=self.components,
+                 version=np.array(self.version))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['mean'], data['components'], version=int(data['version']))
+
+def projection_path(db_path, version):
+    """Where a projection model version for db_path is persisted"""
+    return f"{os.path.splitext(db_path)[0]}.pca.v{version}.npz"
+
+def legacy_projection_path(db_path):
+    """Where models were persisted before each version got its own file"""
+    return f"{os.path.splitext(db_path)[0]}.pca.npz"
+
+def load_projection(db_path, version):
+    """Load the model version the database's encodings were projected with"""
+    path = projection_path(db_path, version)
+    if not os.path.exists(path):
+        legacy_path = legacy_projection_path(db_path)
+        if os.path.exists(legacy_path):
+            projection = PCAProjection.load(legacy_path)
+            if projection.version == version:
+                return projection
+    return PCAProjection.load(path)
@@ -0,0 +1,99 @@
+import numpy as np
+
+# In-memory / on-disk encoding precisions, smallest last
+QUANTIZATION_MODES = ('float32', 'float16', 'int8')
+# numpy dtype recorded in encoding_dtype for each mode
+STORAGE_DTYPES = {'float32': '<f4', 'float16': '<f2', 'int8': 'i1'}
+INT8_DTYPE = STORAGE_DTYPES['int8']
+# Rows widened to float32 at a time when scoring quantized rows
+SCORE_BLOCK_ROWS = 16384
+
+def int8_codes(matrix):
+    """Symmetric per-row int8 codes; returns (codes, scales) with row ~= codes * scale"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    scales = (np.abs(matrix).max(axis=1, initial=0) / 127.0).astype(np.float32)
+    scales[scales == 0] = 1.0
+    codes = np.rint(matrix / scales[:, None]).astype(np.int8)
+    return codes, scales
+
+def quantize_rows(matrix, mode):
+    """Store a row-normalized float32 matrix at the given precision
+
+    float32 comes back unchanged; the other modes return a QuantizedMatrix.
+    """
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization {mode!r}, expected one of {QUANTIZATION_MODES}")
+
+    if mode == 'float32':
+        return np.asarray(matrix, dtype=np.float32)
+    if mode == 'float16':
+        return QuantizedMatrix(np.asarray(matrix, dtype=np.float16))
+
+    codes, _ = int8_codes(matrix)
+    return QuantizedMatrix(codes, unit_scales(codes))
+
+def unit_scales(codes):
+    """Per-row scales that give every dequantized int8 row unit length
+
+    Products with a normalized query are then cosine similarities of the
+    stored vector, with no separate norm correction.
+    """
+    norms = np.linalg.norm(codes.astype(np.float32), axis=1)
+    norms[norms == 0] = 1.0
+    return (1.0 / norms).astype(np.float32)
+
+class QuantizedMatrix:
+    """Read-only (n, dim) matrix held as float16 or per-row scaled int8 codes
+
+    Row i stands for codes[i] * scales[i] (scales is None for float16). It
+    supports the operations the matching code uses on float32 galleries:
+    shape, row slicing and indexing, and `matrix @ other`. Products widen at
+    most SCORE_BLOCK_ROWS rows to float32 at a time and apply the int8 scales
+    to the product rather than the codes, so a full-precision copy of the
+    matrix never exists.
+    """
+
+    def __init__(self, codes, scales=None):
+        self.codes = codes
+        self.scales = scales
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def __len__(self):
+        return self.codes.shape[0]
+
+    def __getitem__(self, rows):
+        if isinstance(rows, (int, np.integer)):
+            return self[rows:rows + 1].dequantize()[0]
+        scales = self.scales[rows] if self.scales is not None else None
+        return QuantizedMatrix(self.codes[rows], scales)
+
+    def dequantize(self):
+        """float32 copy of the matrix"""
+        matrix = self.codes.astype(np.float32)
+        if self.scales is not None:
+            matrix *= self.scales[:, None]
+        return matrix
+
+    def __array__(self, dtype=None, copy=None):
+        matrix = self.dequantize()
+        return matrix if dtype is None else matrix.astype(dtype, copy=False)
+
+    def __matmul__(self, other):
+        other = np.asarray(other, dtype=np.float32)
+        n = self.codes.shape[0]
+        result = np.empty((n,) + other.shape[1:], dtype=np.float32)
+
+        for start in range(0, n, SCORE_BLOCK_ROWS):
+            block = self.codes[start:start + SCORE_BLOCK_ROWS].astype(np.float32) @ other
+            if self.scales is not None:
+                scales = self.scales[start:start + SCORE_BLOCK_ROWS]
+                block *= scales if block.ndim == 1 else scales[:, None]
+            result[start:start + SCORE_BLOCK_ROWS] = block
+        return result
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Check that parallel matching finds exactly what single-process matching finds
+
+Builds identical synthetic databases (see benchmark_suite.SyntheticGallery)
+and runs find_matches with match_workers=1 and with several workers on them:
+a full run and an incremental run after a further insert batch, each with
+and without the candidate filter. Every run must return the same
+pairs with bit-identical scores. Exits non-zero on any difference.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+from benchmark_suite import SyntheticGallery, _insert
+from candidate_filter import CandidateFilter
+from face_recognition_system import FaceRecognitionSystem
+from quantization import QUANTIZATION_MODES
+
+def _pairs(matches):
+    return sorted((match['missing_case'], match['body_case'], match['confidence']) for match in matches)
+
+def _compare(name, serial, parallel):
+    serial, parallel = _pairs(serial), _pairs(parallel)
+    identical = serial == parallel
+    print(f"{name:<32} {len(serial):>8} pairs  {'identical' if identical else 'DIFFERENT'}")
+    return identical
+
+def verify(tmp_dir, persons=5000, bodies=5000, planted=500, dim=128, threshold=0.3, workers=4,
+           shard_size=1000, block_size=256, quantization='float32', seed=0):
+    """Run every comparison in databases created under tmp_dir; returns True if all agree"""
+    generator = SyntheticGallery(dim=dim, seed=seed)
+    person_records = generator.missing_persons(persons)
+    body_records = generator.unidentified_bodies(bodies, planted_from=person_records[:planted])
+    new_persons = generator.missing_persons(max(1, persons // 10))
+    new_bodies = generator.unidentified_bodies(max(1, bodies // 10), planted_from=new_persons[:planted // 10])
+
+    # Match watermarks live in the database, so every configuration gets its
+    # own copy of the same records
+    systems = {}
+    for filtered in (False, True):
+        for match_workers in (1, workers):
+            face_system = FaceRecognitionSystem(
+                db_path=os.path.join(tmp_dir, f"verify_{int(filtered)}_{match_workers}.db"),
+                match_threshold=None, block_size=block_size, match_workers=match_workers,
+                match_shard_size=shard_size, quantization=quantization, candidate_filter=CandidateFilter() if filtered else None)
+            _insert(face_system.db, person_records, body_records, batch_size=1000)
+            systems[filtered, match_workers] = face_system
+
+    ok = True
+    for incremental in (False, True):
+        if incremental:
+            for face_system in systems.values():
+                _insert(face_system.db, new_persons, new_bodies, batch_size=1000)
+        for filtered in (False, True):
+            name = f"{'incremental' if incremental else 'full'} match ({'filtered' if filtered else 'unfiltered'})"
+            ok &= _compare(name, systems[filtered, 1].find_matches(threshold, incremental),
+                           systems[filtered, workers].find_matches(threshold, incremental))
+
+    for face_system in systems.values():
+        if face_system._parallel_matcher is not None:
+            face_system._parallel_matcher.close()
+    return ok
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--persons', type=int, default=5000, help='missing persons to generate')
+    parser.add_argument('--bodies', type=int, default=5000, help='unidentified bodies to generate')
+    parser.add_argument('--dim', type=int, default=128, help='encoding dimensions')
+    parser.add_argument('--threshold', type=float, default=0.3,
+                        help='match threshold (low, so runs find many pairs)')
+    parser.add_argument('--workers', type=int, default=4, help='processes for the parallel runs')
+    parser.add_argument('--shard-size', type=int, default=1000, help='bodies scored per parallel task')
+    parser.add_argument('--block-size', type=int, default=256, help='rows per similarity tile')
+    parser.add_argument('--quantization', choices=QUANTIZATION_MODES, default='float32')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        ok = verify(tmp_dir, persons=args.persons, bodies=args.bodies,
+                    dim=args.dim, threshold=args.threshold, workers=args.workers,
+                    shard_size=args.shard_size, block_size=args.block_size,
+                    quantization=args.quantization, seed=args.seed)
+    print("\nParallel matching matches single-process results" if ok
+          else "\nParallel matching DIFFERS from single-process results")
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Match faces in recorded CCTV footage or video files against missing persons
+
+Frames are sampled at a fixed rate (skipped frames are grabbed without being
+decoded) and the Haar cascade runs only on every few sampled frames. In
+between, each face is followed by template matching in a small window around
+its last position, and fresh detections are tied to existing tracks by box
+overlap. Each track keeps its sharpest detected crop, which is encoded once
+when the track ends, so a person walking past the camera yields one
+embedding instead of one per frame. Finished tracks are searched against the
+in-memory missing persons gallery together, in one matrix product. People
+walking past a camera are alive, so unidentified bodies are not searched.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import cv2
+import numpy as np
+from face_recognition_system import FACE_SIZE, FaceRecognitionSystem
+from metrics import increment, timed
+
+# Frames per second of video processed when the source runs faster
+DEFAULT_SAMPLE_FPS = 5.0
+# Sampled frames per cascade run; faces are tracked in the frames between
+DEFAULT_DETECT_EVERY = 3
+# A detection continues a track when their boxes overlap at least this much
+TRACK_IOU = 0.3
+# Template-match score below which a tracked face counts as lost in a frame
+TRACK_MIN_SCORE = 0.5
+# Search window around a tracked face, as a fraction of its size per side
+TRACK_MARGIN = 0.5
+# Used when a stream does not report its frame rate
+FALLBACK_FPS = 25.0
+
+def box_iou(boxes, others):
+    """(len(boxes), len(others)) intersection-over-union of (x, y, w, h) boxes"""
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 1, 4)
+    others = np.asarray(others, dtype=np.float32).reshape(1, -1, 4)
+    overlap_w = np.clip(np.minimum(boxes[..., 0] + boxes[..., 2], others[..., 0] + others[..., 2])
+                        - np.maximum(boxes[..., 0], others[..., 0]), 0, None)
+    overlap_h = np.clip(np.minimum(boxes[..., 1] + boxes[..., 3], others[..., 1] + others[..., 3])
+                        - np.maximum(boxes[..., 1], others[..., 1]), 0, None)
+    overlap = overlap_w * overlap_h
+    union = boxes[..., 2] * boxes[..., 3] + others[..., 2] * others[..., 3] - overlap
+    return overlap / np.maximum(union, 1e-6)
+
+def face_quality(face_image):
+    """How useful a crop is for matching: sharpness, discounted for small faces
+
+    Sharpness is the variance of the Laplacian at extraction size; faces
+    smaller than FACE_SIZE lose detail when upscaled and score lower.
+    """
+    gray = cv2.cvtColor(cv2.resize(face_image, FACE_SIZE), cv2.COLOR_BGR2GRAY)
+    sharpness = cv2.Laplacian(gray, cv2.CV_32F).var()
+    return float(sharpness) * min(1.0, min(face_image.shape[:2]) / FACE_SIZE[0])
+
+class Track:
+    """One face followed across frames"""
+
+    def __init__(self, track_id, frame_index, box, face_image, gray):
+        self.id = track_id
+        self.first_frame = self.last_frame = frame_index
+        self.box = tuple(int(value) for value in box)
+        self.detections = 0
+        self.missed = 0
+        self.best_quality = -1.0
+        self.best_face = None
+        self.best_box = None
+        self.best_frame = None
+        self.observe(frame_index, box, face_image, gray)
+
+    def observe(self, frame_index, box, face_image, gray):
+        """Update from a cascade detection, keeping the crop if it is the best so far"""
+        self.box = tuple(int(value) for value in box)
+        self.last_frame = frame_index
+        self.detections += 1
+        self.missed = 0
+        x, y, w, h = self.box
+        self.template = gray[y:y+h, x:x+w].copy()
+
+        quality = face_quality(face_image)
+        if quality > self.best_quality:
+            self.best_quality = quality
+            self.best_face = face_image.copy()
+            self.best_box = self.box
+            self.best_frame = frame_index
+
+    def follow(self, frame_index, gray):
+        """Move the box to the best template match near its last position"""
+        x, y, w, h = self.box
+        height, width = gray.shape
+        margin_x, margin_y = int(w * TRACK_MARGIN), int(h * TRACK_MARGIN)
+        left, top = max(0, x - margin_x), max(0, y - margin_y)
+        right, bottom = min(width, x + w + margin_x), min(height, y + h + margin_y)
+        window = gray[top:bottom, left:right]
+        if window.shape[0] < h or window.shape[1] < w:
+            self.missed += 1
+            return
+
+        scores = cv2.matchTemplate(window, self.template, cv2.TM_CCOEFF_NORMED)
+        _, score, _, (match_x, match_y) = cv2.minMaxLoc(scores)
+        if score < TRACK_MIN_SCORE:
+            self.missed += 1
+            return
+        self.box = (left + match_x, top + match_y, w, h)
+        self.last_frame = frame_index
+
+class VideoMatcher:
+    """Sample, detect, track and match faces in a video
+
+    sample_fps    frames per second of video processed (None: every frame)
+    detect_every  sampled frames per cascade run
+    max_missed    sampled frames a track may go unseen before it ends
+                  (default: two detection intervals)
+    min_detections  tracks detected fewer times are dropped as likely
+                  false positives
+    """
+
+    def __init__(self, face_system, sample_fps=DEFAULT_SAMPLE_FPS, detect_every=DEFAULT_DETECT_EVERY,
+                 max_missed=None, min_detections=2, threshold=0.6, k=5):
+        self.face_system = face_system
+        self.sample_fps = sample_fps
+        self.detect_every = max(1, detect_every)
+        self.max_missed = max_missed if max_missed is not None else 2 * self.detect_every
+        self.min_detections = min_detections
+        self.threshold = threshold
+        self.k = k
+        self.stats = {}
+
+    def run(self, source, max_frames=None):
+        """Yield one result dict per finished track, with its missing person matches
+
+        source is a video file path, a stream URL or a camera index.
+        Throughput so far is kept in self.stats.
+        """
+        capture = cv2.VideoCapture(source)
+        if not capture.isOpened():
+            raise IOError(f"Could not open video {source}")
+
+        source_fps = capture.get(cv2.CAP_PROP_FPS) or FALLBACK_FPS
+        step = 1
+        if self.sample_fps:
+            step = max(1, round(source_fps / self.sample_fps))
+
+        self.stats = {'source_fps': source_fps, 'frames': 0, 'sampled_frames': 0, 'detection_frames': 0,
+                      'tracks': 0, 'matched_tracks': 0}
+        tracks = []
+        next_id = 1
+        sampled = 0
+        start_time = time.perf_counter()
+
+        try:
+            frames = 0
+            while max_frames is None or frames < max_frames:
+                frame_index = frames
+                # Frames between samples are grabbed but never decoded
+                if frame_index % step:
+                    with timed('video_grab'):
+                        if not capture.grab():
+                            break
+                    frames += 1
+                    continue
+                with timed('video_read'):
+                    ok, frame = capture.read()
+                if not ok:
+                    break
+                frames += 1
+
+                sampled += 1
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                if (sampled - 1) % self.detect_every == 0:
+                    next_id = self._detect(frame, gray, frame_index, tracks, next_id)
+                    self.stats['detection_frames'] += 1
+                else:
+                    with timed('video_track'):
+                        for track in tracks:
+                            track.follow(frame_index, gray)
+
+                finished = [track for track in tracks if track.missed > self.max_missed]
+                if finished:
+                    tracks = [track for track in tracks if track.missed <= self.max_missed]
+                    yield from self._match(finished, source_fps)
+                self._update_stats(frames, sampled, start_time)
+
+            yield from self._match(tracks, source_fps)
+            self._update_stats(frames, sampled, start_time)
+        finally:
+            capture.release()
+            increment('frs_video_frames_total', self.stats['frames'])
+
+    def _detect(self, frame, gray, frame_index, tracks, next_id):
+        faces, boxes = self.face_system.detect_faces_in_image(frame)
+        unmatched = list(range(len(faces)))
+
+        if tracks and len(faces):
+            overlaps = box_iou([track.box for track in tracks], boxes)
+            # Greedily pair the most overlapping track and detection first
+            for flat in np.argsort(-overlaps, axis=None):
+                row, col = np.unravel_index(flat, overlaps.shape)
+                if overlaps[row, col] < TRACK_IOU:
+                    break
+                if tracks[row].last_frame == frame_index or col not in unmatched:
+                    continue
+                tracks[row].observe(frame_index, boxes[col], faces[col], gray)
+                unmatched.remove(col)
+
+        for track in tracks:
+            if track.last_frame != frame_index:
+                track.missed += 1
+        for col in unmatched:
+            tracks.append(Track(next_id, frame_index, boxes[col], faces[col], gray))
+            next_id += 1
+        return next_id
+
+    def _match(self, finished, source_fps):
+        """Encode each kept track's best crop and search all of them at once"""
+        finished = [track for track in finished if track.detections >= self.min_detections]
+        if not finished:
+            return
+        encodings = [self.face_system.extract_face_features(track.best_face) for track in finished]
+        kept = [(track, encoding) for track, encoding in zip(finished, encodings) if encoding is not None]
+        if not kept:
+            return
+
+        searched = self.face_system.search_by_encodings([encoding for _, encoding in kept],
+                                                        self.threshold, self.k, tables=('missing_persons',))
+        for (track, _), matches in zip(kept, searched):
+            self.stats['tracks'] += 1
+            if matches:
+                self.stats['matched_tracks'] += 1
+            yield {
+                'track': track.id,
+                'first_frame': track.first_frame,
+                'last_frame': track.last_frame,
+                'start_seconds': round(track.first_frame / source_fps, 2),
+                'end_seconds': round(track.last_frame / source_fps, 2),
+                'detections': track.detections,
+                'best_frame': track.best_frame,
+                'best_box': [int(value) for value in track.best_box],
+                'best_face': track.best_face,
+                'matches': matches
+            }
+
+    def _update_stats(self, frames, sampled, start_time):
+        elapsed = time.perf_counter() - start_time
+        self.stats.update({
+            'frames': frames,
+            'sampled_frames': sampled,
+            'elapsed_seconds': round(elapsed, 3),
+            'fps': round(frames / elapsed, 1) if elapsed else 0.0,
+            'sampled_fps': round(sampled / elapsed, 1) if elapsed else 0.0,
+            # Above 1 the video is processed faster than it plays
+            'realtime_factor': round(frames / self.stats['source_fps'] / elapsed, 2) if elapsed else 0.0
+        })
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('source', help='video file, stream URL or camera index')
+    parser.add_argument('--db', default='police_records.db', help='database path')
+    parser.add_argument('--sample-fps', type=float, default=DEFAULT_SAMPLE_FPS,
+                        help='frames per second of video to process (0: every frame)')
+    parser.add_argument('--detect-every', type=int, default=DEFAULT_DETECT_EVERY,
+                        help='sampled frames per face detection; faces are tracked in between')
+    parser.add_argument('--min-detections', type=int, default=2,
+                        help='drop tracks detected fewer times than this')
+    parser.add_argument('--threshold', type=float, default=0.6, help='match threshold')
+    parser.add_argument('--k', type=int, default=5, help='matches reported per track')
+    parser.add_argument('--max-frames', type=int, default=None, help='stop after this many frames')
+    parser.add_argument('--detection-max-side', type=int, default=None,
+                        help='detect faces on frames downscaled to this longer side (fast mode)')
+    parser.add_argument('--save-faces', help='write each track\'s best face crop to this folder')
+    parser.add_argument('--output', help='write the JSON report here')
+    args = parser.parse_args(argv)
+
+    source = int(args.source) if args.source.isdigit() else args.source
+    face_system = FaceRecognitionSystem(db_path=args.db, detection_max_side=args.detection_max_side)
+    matcher = VideoMatcher(face_system, sample_fps=args.sample_fps or None, detect_every=args.detect_every,
+                           min_detections=args.min_detections, threshold=args.threshold, k=args.k)
+    if args.save_faces:
+        os.makedirs(args.save_faces, exist_ok=True)
+
+    tracks = []
+    for track in matcher.run(source, max_frames=args.max_frames):
+        best_face = track.pop('best_face')
+        if args.save_faces:
+            track['face_path'] = os.path.join(args.save_faces, f"track_{track['track']:05d}.jpg")
+            cv2.imwrite(track['face_path'], best_face)
+        tracks.append(track)
+
+        print(f"Track {track['track']} ({track['start_seconds']}s-{track['end_seconds']}s, "
+              f"{track['detections']} detections): {len(track['matches'])} matches")
+        for match in track['matches']:
+            print(f"  {match['type']} {match['case_number']} confidence {match['confidence']:.3f}")
+
+    stats = matcher.stats
+    print(f"\nProcessed {stats['frames']} frames ({stats['sampled_frames']} sampled, "
+          f"{stats['detection_frames']} detected) in {stats['elapsed_seconds']}s: "
+          f"{stats['fps']} frames/s, {stats['realtime_factor']}x real time")
+    print(f"{stats['tracks']} tracks, {stats['matched_tracks']} with matches")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'stats': stats, 'tracks': tracks}, f, indent=2)
+
+if __name__ == "__main__":
+    print("Police Facial Recognition System - Video Matching")
+    print("=" * 60)
+    main(sys.argv[1:])
@@ -1,8 +1,13 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, jsonify
+import multiprocessing
 import os
 from werkzeug.utils import secure_filename
+from candidate_filter import DEFAULT_AGE_TOLERANCE, CandidateFilter
 from face_recognition_system import FaceRecognitionSystem
-from database import PoliceDatabase
+from database import MISSING_PERSON_SORTS, UNIDENTIFIED_BODY_SORTS, PoliceDatabase
+import metrics
+from gallery_cache import peek_gallery_cache
+from job_queue import JobQueue, JobWorkerPool, job_queue_path
 import json
 from datetime import datetime
 
@@ -10,20 +15,138 @@ app = Flask(__name__)
 app.secret_key = 'police_facial_recognition_secret_key'
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+# Gallery precision per worker: float32, float16 (half the memory) or int8 (a quarter)
+app.config['ENCODING_QUANTIZATION'] = os.environ.get('ENCODING_QUANTIZATION', 'float32')
+# Map galleries from shared files so worker processes don't each decode a copy
+app.config['EMBEDDING_STORE'] = os.environ.get('EMBEDDING_STORE', '1') == '1'
+# Fast detection: run the face detector on uploads downscaled to this longer side
+app.config['DETECTION_MAX_SIDE'] = int(os.environ.get('DETECTION_MAX_SIDE', 0)) or None
+# Skip scoring pairs ruled out by gender, age (within MATCH_AGE_TOLERANCE years)
+# or dates when matching new records
+app.config['CANDIDATE_FILTER'] = os.environ.get('CANDIDATE_FILTER', '0') == '1'
+app.config['MATCH_AGE_TOLERANCE'] = int(os.environ.get('MATCH_AGE_TOLERANCE', DEFAULT_AGE_TOLERANCE))
+# Processes used by full match runs (0: one per CPU)
+app.config['MATCH_WORKERS'] = int(os.environ.get('MATCH_WORKERS', 1)) or None
+# Background threads processing uploads; jobs running longer than the
+# timeout are assumed orphaned by a crashed worker and re-queued at startup
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+app.config['JOB_TIMEOUT'] = 600
+# Uploads are spooled with their job and decoded from memory; record photos
+# are then written to UPLOAD_FOLDER by the job worker unless SAVE_UPLOADS=0,
+# and search photos only with SAVE_SEARCH_UPLOADS=1
+app.config['SAVE_UPLOADS'] = os.environ.get('SAVE_UPLOADS', '1') == '1'
+app.config['SAVE_SEARCH_UPLOADS'] = os.environ.get('SAVE_SEARCH_UPLOADS', '0') == '1'
+# Decode large JPEGs at reduced size in fast detection mode
+app.config['REDUCED_DECODE'] = os.environ.get('REDUCED_DECODE', '0') == '1'
+# Per-stage timings and cache hit rates, served at /metrics unless
+# FRS_METRICS=0 (read by the metrics module for every entry point)
+app.config['METRICS'] = metrics.is_enabled()
 
 # Create upload directory
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], 'missing_persons'), exist_ok=True)
 os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], 'unidentified_bodies'), exist_ok=True)
 
-face_system = FaceRecognitionSystem()
-db = PoliceDatabase()
+face_system = FaceRecognitionSystem(quantization=app.config['ENCODING_QUANTIZATION'],
+                                    embedding_store=app.config['EMBEDDING_STORE'],
+                                    detection_max_side=app.config['DETECTION_MAX_SIDE'],
+                                    candidate_filter=CandidateFilter(age_tolerance=app.config['MATCH_AGE_TOLERANCE'])
+                                    if app.config['CANDIDATE_FILTER'] else None,
+                                    match_workers=app.config['MATCH_WORKERS'],
+                                    reduced_decode=app.config['REDUCED_DECODE'])
+db = PoliceDatabase(quantization=app.config['ENCODING_QUANTIZATION'],
+                    embedding_store=app.config['EMBEDDING_STORE'])
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+# Largest page the record lists will render
+MAX_PAGE_SIZE = 500
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def upload_path(folder, filename, save):
+    """Where an upload will be kept, or None if it is not kept"""
+    return os.path.join(app.config['UPLOAD_FOLDER'], folder, filename) if save else None
+
+def save_upload(path, photo):
+    """Keep an uploaded photo on disk; runs in the job worker after processing"""
+    if path is None or photo is None:
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(photo)
+
+# Handlers get the upload's bytes from the job's spooled data; jobs queued
+# before uploads were spooled (photo None) read the saved file instead
+
+def run_add_missing_person(payload, photo):
+    person_id = face_system.process_missing_person_photo(
+        photo if photo is not None else payload['photo_path'], payload['person_data'],
+        photo_path=payload['photo_path'] or '')
+    if not person_id:
+        raise ValueError('no face detected')
+    save_upload(payload['photo_path'], photo)
+    return {'record_id': person_id}
+
+def run_add_unidentified_body(payload, photo):
+    body_id = face_system.process_unidentified_body_photo(
+        photo if photo is not None else payload['photo_path'], payload['body_data'],
+        photo_path=payload['photo_path'] or '')
+    if not body_id:
+        raise ValueError('no face detected')
+    save_upload(payload['photo_path'], photo)
+    return {'record_id': body_id}
+
+def run_search(payload, photo):
+    matches = face_system.search_by_photo(photo if photo is not None else payload['photo_path'],
+                                          payload['threshold'], k=payload['top_k'])
+    save_upload(payload['photo_path'], photo)
+    return {'matches': matches}
+
+def run_search_batch(payload, photos):
+    photos = photos if photos is not None else payload['photo_paths']
+    results = face_system.search_batch(photos, payload['threshold'], k=payload['top_k'])
+    for path, photo in zip(payload['photo_paths'], photos):
+        if isinstance(photo, bytes):
+            save_upload(path, photo)
+    return {'results': [{'query_image': query_image, 'face_found': matches is not None,
+                         'matches': matches or []}
+                        for query_image, matches in zip(payload['query_images'], results)]}
+
+# Uploads are processed off the request thread; routes return a job id at once
+job_queue = JobQueue(job_queue_path(face_system.db.db_path))
+job_workers = JobWorkerPool(job_queue, {
+    'add_missing_person': run_add_missing_person,
+    'add_unidentified_body': run_add_unidentified_body,
+    'search': run_search,
+    'search_batch': run_search_batch
+}, workers=app.config['JOB_WORKERS'])
+# Matching worker processes re-import the main script, and with it this
+# module; only the serving process requeues and runs jobs
+if multiprocessing.current_process().name == 'MainProcess':
+    job_queue.requeue_stale(app.config['JOB_TIMEOUT'])
+    job_workers.start()
+
+def gallery_size_metrics():
+    gallery = peek_gallery_cache(db.db_path)
+    if gallery is None:
+        return {}
+    return {(('table', table),): len(gallery.gallery(table))
+            for table in ('missing_persons', 'unidentified_bodies')}
+
+def job_metrics():
+    return {(('status', status),): count for status, count in job_queue.status_counts().items()}
+
+metrics.register_gauge('frs_gallery_records', 'Active records with an encoding in the in-memory gallery',
+                       gallery_size_metrics)
+metrics.register_gauge('frs_jobs', 'Background jobs by status', job_metrics)
+
+def job_response(job_id):
+    """202 with the job id for API clients, otherwise the job's status page"""
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'job_id': job_id, 'status_url': url_for('api_job', job_id=job_id)}), 202
+    return redirect(url_for('job_status', job_id=job_id))
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -52,8 +175,7 @@ def add_missing_person():
         
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], 'missing_persons', filename)
-            file.save(filepath)
+            filepath = upload_path('missing_persons', filename, app.config['SAVE_UPLOADS'])
             
             # Process the photo
             person_data = {
@@ -66,13 +188,10 @@ def add_missing_person():
                 'case_number': case_number
             }
             
-            person_id = face_system.process_missing_person_photo(filepath, person_data)
-            
-            if person_id:
-                flash(f'Missing person {name} added successfully with ID: {person_id}')
-                return redirect(url_for('view_missing_persons'))
-            else:
-                flash('Error processing photo - no face detected')
+            job_id = job_workers.submit('add_missing_person',
+                                        {'photo_path': filepath, 'person_data': person_data},
+                                        data=file.read())
+            return job_response(job_id)
         else:
             flash('Invalid file type')
     
@@ -99,8 +218,7 @@ def add_unidentified_body():
         
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], 'unidentified_bodies', filename)
-            file.save(filepath)
+            filepath = upload_path('unidentified_bodies', filename, app.config['SAVE_UPLOADS'])
             
             body_data = {
                 'case_number': case_number,
@@ -111,13 +229,10 @@ def add_unidentified_body():
                 'description': description
             }
             
-            body_id = face_system.process_unidentified_body_photo(filepath, body_data)
-            
-            if body_id:
-                flash(f'Unidentified body case {case_number} added successfully with ID: {body_id}')
-                return redirect(url_for('view_unidentified_bodies'))
-            else:
-                flash('Error processing photo - no face detected')
+            job_id = job_workers.submit('add_unidentified_body',
+                                        {'photo_path': filepath, 'body_data': body_data},
+                                        data=file.read())
+            return job_response(job_id)
         else:
             flash('Invalid file type')
     
@@ -138,14 +253,14 @@ def search():
             
             if file and allowed_file(file.filename):
                 filename = secure_filename(file.filename)
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], 'search', filename)
-                os.makedirs(os.path.dirname(filepath), exist_ok=True)
-                file.save(filepath)
+                filepath = upload_path('search', filename, app.config['SAVE_SEARCH_UPLOADS'])
                 
                 threshold = float(request.form.get('threshold', 0.6))
-                matches = face_system.search_by_photo(filepath, threshold)
-                
-                return render_template('search_results.html', matches=matches, query_image=filename)
+                top_k = int(request.form.get('top_k', 10))
+                job_id = job_workers.submit('search', {'photo_path': filepath, 'query_image': filename,
+                                                       'threshold': threshold, 'top_k': top_k},
+                                            data=file.read())
+                return job_response(job_id)
             else:
                 flash('Invalid file type')
         except Exception as e:
@@ -154,33 +269,166 @@ def search():
     
     return render_template('search.html')
 
+@app.route('/api/search_batch', methods=['POST'])
+def api_search_batch():
+    """Search with several photos (multipart field 'photos') as one background job
+
+    Returns 202 with the job id; the job result at /api/jobs/<id> holds the
+    top-k matches of each photo, in upload order.
+    """
+    files = [file for file in request.files.getlist('photos') if file.filename]
+    if not files:
+        return jsonify({'error': 'no photos uploaded'}), 400
+    invalid = [file.filename for file in files if not allowed_file(file.filename)]
+    if invalid:
+        return jsonify({'error': 'invalid file type', 'files': invalid}), 400
+    
+    try:
+        threshold = float(request.form.get('threshold', 0.6))
+        top_k = int(request.form.get('top_k', 10))
+    except ValueError:
+        return jsonify({'error': 'threshold and top_k must be numbers'}), 400
+    
+    batch_dir = f"batch_{datetime.now():%Y%m%d_%H%M%S_%f}"
+    photo_paths, query_images = [], []
+    for index, file in enumerate(files):
+        filename = secure_filename(file.filename)
+        # Prefix with the position so same-named photos don't overwrite each other
+        photo_paths.append(upload_path(os.path.join('search', batch_dir), f"{index:04d}_{filename}",
+                                       app.config['SAVE_SEARCH_UPLOADS']))
+        query_images.append(filename)
+    
+    job_id = job_workers.submit('search_batch', {'photo_paths': photo_paths, 'query_images': query_images,
+                                                 'threshold': threshold, 'top_k': top_k},
+                                data=[file.read() for file in files])
+    return jsonify({'job_id': job_id, 'status_url': url_for('api_job', job_id=job_id)}), 202
+
+@app.route('/jobs/<int:job_id>')
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        flash(f'Job {job_id} not found')
+        return redirect(url_for('index'))
+    
+    payload = job['payload']
+    if job['kind'] == 'search_batch' and job['status'] in ('done', 'failed'):
+        # Batch searches are API-only; their result is JSON
+        return redirect(url_for('api_job', job_id=job_id))
+    if job['status'] == 'failed':
+        flash(f"Error processing photo - {job['error']}")
+        return redirect(url_for(job['kind']))
+    
+    if job['status'] == 'done':
+        if job['kind'] == 'search':
+            return render_template('search_results.html', matches=job['result']['matches'],
+                                   query_image=payload['query_image'])
+        if job['kind'] == 'add_missing_person':
+            flash(f"Missing person {payload['person_data']['name']} added successfully "
+                  f"with ID: {job['result']['record_id']}")
+            return redirect(url_for('view_missing_persons'))
+        flash(f"Unidentified body case {payload['body_data']['case_number']} added successfully "
+              f"with ID: {job['result']['record_id']}")
+        return redirect(url_for('view_unidentified_bodies'))
+    
+    return render_template('job_status.html', job=job)
+
+@app.route('/api/jobs/<int:job_id>')
+def api_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'job not found'}), 404
+    
+    return jsonify({
+        'id': job['id'],
+        'kind': job['kind'],
+        'status': job['status'],
+        'result': job['result'],
+        'error': job['error'],
+        'created': job['created'],
+        'started': job['started'],
+        'finished': job['finished']
+    })
+
 @app.route('/find_matches')
 def find_matches():
     threshold = float(request.args.get('threshold', 0.7))
-    matches = face_system.find_matches(threshold)
+    incremental = request.args.get('incremental') == '1'
+    matches = face_system.find_matches(threshold, incremental=incremental)
     return render_template('matches.html', matches=matches)
 
+@app.route('/api/find_matches')
+def api_find_matches():
+    """Stream a match run as newline-delimited JSON, one match per line
+
+    Each block of matches is written as soon as it is scored and saved, so
+    clients see the first results quickly and large runs never build the
+    full list in memory.
+    """
+    try:
+        threshold = float(request.args.get('threshold', 0.7))
+    except ValueError:
+        return jsonify({'error': 'threshold must be a number'}), 400
+    incremental = request.args.get('incremental') == '1'
+    
+    def generate():
+        for block in face_system.iter_matches(threshold, incremental=incremental):
+            if block:
+                yield ''.join(json.dumps(match) + '\n' for match in block)
+    
+    # X-Accel-Buffering stops reverse proxies holding blocks back
+    return Response(generate(), mimetype='application/x-ndjson', headers={'X-Accel-Buffering': 'no'})
+
+def listing_filters(default_status, sorts):
+    """Sort/filter query parameters of a list page, with defaults filled in"""
+    sort = request.args.get('sort', 'id')
+    return {
+        'per_page': max(1, min(request.args.get('per_page', 50, type=int), MAX_PAGE_SIZE)),
+        'sort': sort if sort in sorts else 'id',
+        'order': 'desc' if request.args.get('order') == 'desc' else 'asc',
+        'status': request.args.get('status', default_status),
+        'gender': request.args.get('gender', ''),
+        'q': request.args.get('q', '')
+    }
+
+def list_page(list_records, filters):
+    return list_records(limit=filters['per_page'], after=request.args.get('after'),
+                        before=request.args.get('before'), sort=filters['sort'],
+                        descending=filters['order'] == 'desc', status=filters['status'] or None,
+                        gender=filters['gender'] or None, search=filters['q'] or None)
+
 @app.route('/view_missing_persons')
 def view_missing_persons():
-    missing_persons = db.get_all_missing_persons()
-    return render_template('view_missing_persons.html', persons=missing_persons)
+    filters = listing_filters('MISSING', MISSING_PERSON_SORTS)
+    try:
+        page = list_page(db.list_missing_persons, filters)
+    except ValueError as e:
+        flash(str(e))
+        return redirect(url_for('view_missing_persons'))
+    return render_template('view_missing_persons.html', persons=page['records'], page=page,
+                           filters=filters, sorts=MISSING_PERSON_SORTS,
+                           statuses=('MISSING', 'FOUND'))
 
 @app.route('/view_unidentified_bodies')
 def view_unidentified_bodies():
-    unidentified_bodies = db.get_all_unidentified_bodies()
-    return render_template('view_unidentified_bodies.html', bodies=unidentified_bodies)
+    filters = listing_filters('UNIDENTIFIED', UNIDENTIFIED_BODY_SORTS)
+    try:
+        page = list_page(db.list_unidentified_bodies, filters)
+    except ValueError as e:
+        flash(str(e))
+        return redirect(url_for('view_unidentified_bodies'))
+    return render_template('view_unidentified_bodies.html', bodies=page['records'], page=page,
+                           filters=filters, sorts=UNIDENTIFIED_BODY_SORTS,
+                           statuses=('UNIDENTIFIED', 'IDENTIFIED'))
+
+@app.route('/metrics')
+def metrics_endpoint():
+    if not metrics.is_enabled():
+        return Response('metrics are disabled\n', status=404, mimetype='text/plain')
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/api/stats')
 def api_stats():
-    missing_count = len(db.get_all_missing_persons())
-    bodies_count = len(db.get_all_unidentified_bodies())
-    matches_count = len(db.get_matches(0.6))
-    
-    return jsonify({
-        'missing_persons': missing_count,
-        'unidentified_bodies': bodies_count,
-        'potential_matches': matches_count
-    })
+    return jsonify(db.get_stats(0.6))
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file